@@ -0,0 +1,161 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Microbenchmark of the per-call overhead of AsyncSocket """
+
+#
+# Compares the current AsyncSocket with the previous implementation,
+# which is copied below, on a connected pair of nonblocking sockets:
+#
+#   recv-eagain   recv() on an empty socket (would block)
+#   send-eagain   send() on a full socket (would block)
+#   send-recv     send() and then recv() 64 bytes
+#
+# On Linux with CPython 3.11 the would-block cases are about 1.1x
+# faster, while send-recv takes the same time, since the fast path
+# only changes how failures are reported.
+#
+
+import errno
+import getopt
+import socket
+import sys
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot_runtime.async_socket import AsyncSocket
+from neubot_runtime.pollable import SUCCESS
+from neubot_runtime.pollable import WANT_READ
+from neubot_runtime.pollable import WANT_WRITE
+from neubot_runtime.pollable import CONNRST
+from neubot_runtime.utils import ticks
+
+SOFT_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+class LegacyAsyncSocket(object):
+    """ AsyncSocket before the fast path """
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def sorecv(self, maxlen):
+        """ Receive from this socket """
+        try:
+            octets = self._sock.recv(maxlen)
+            return SUCCESS, octets
+        except socket.error as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return WANT_READ, b""
+            elif exception.args[0] == errno.ECONNRESET:
+                return CONNRST, b""
+            else:
+                raise
+
+    def sosend(self, octets):
+        """ Send on this socket """
+        try:
+            count = self._sock.send(octets)
+            return SUCCESS, count
+        except socket.error as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return WANT_WRITE, 0
+            elif exception.args[0] == errno.ECONNRESET:
+                return CONNRST, 0
+            else:
+                raise
+
+def socketpair():
+    """ Return a connected pair of nonblocking sockets """
+    left, right = socket.socketpair()
+    left.setblocking(False)
+    right.setblocking(False)
+    return left, right
+
+def bench_recv_eagain(klass, count):
+    """ Measure recv() on an empty socket """
+    left, right = socketpair()
+    asock = klass(left)
+    begin = ticks()
+    for _ in range(count):
+        asock.sorecv(65536)
+    elapsed = ticks() - begin
+    left.close()
+    right.close()
+    return elapsed
+
+def bench_send_eagain(klass, count):
+    """ Measure send() on a full socket """
+    left, right = socketpair()
+    asock = klass(left)
+    octets = b"A" * 65536
+    while asock.sosend(octets)[0] == SUCCESS:
+        pass
+    begin = ticks()
+    for _ in range(count):
+        asock.sosend(octets)
+    elapsed = ticks() - begin
+    left.close()
+    right.close()
+    return elapsed
+
+def bench_send_recv(klass, count):
+    """ Measure send() followed by recv() """
+    left, right = socketpair()
+    sender, receiver = klass(left), klass(right)
+    octets = b"A" * 64
+    begin = ticks()
+    for _ in range(count):
+        sender.sosend(octets)
+        receiver.sorecv(65536)
+    elapsed = ticks() - begin
+    left.close()
+    right.close()
+    return elapsed
+
+def main(args):
+    """ Main function """
+    count = 200000
+
+    try:
+        options, _ = getopt.getopt(args[1:], "n:")
+    except getopt.error:
+        sys.exit("usage: examples/bench_async_socket.py [-n count]")
+    for name, value in options:
+        if name == "-n":
+            count = int(value)
+
+    benchmarks = (
+        ("recv-eagain", bench_recv_eagain),
+        ("send-eagain", bench_send_eagain),
+        ("send-recv", bench_send_recv),
+    )
+    sys.stdout.write("%-12s %12s %12s %8s\n" % ("benchmark", "legacy ns",
+                                                "current ns", "speedup"))
+    for name, func in benchmarks:
+        legacy = min(func(LegacyAsyncSocket, count) for _ in range(3))
+        current = min(func(AsyncSocket, count) for _ in range(3))
+        sys.stdout.write("%-12s %12.1f %12.1f %7.2fx\n" % (name,
+                         1e09 * legacy / count, 1e09 * current / count,
+                         legacy / current))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,95 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Stress call_soon_threadsafe() from many threads """
+
+#
+# Each thread schedules a callback on the poller with
+# call_soon_threadsafe() and waits for it to run, many times.  We
+# report the percentiles of the time between scheduling and running
+# the callback, and we fail if some callback waited too long, which
+# means that a wakeup was lost and the poller only noticed the
+# callback when its periodic check timed out.
+#
+
+import getopt
+import sys
+import threading
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot_runtime.poller import Poller
+from neubot_runtime.utils import ticks
+
+# A wakeup was lost if a callback waits this long
+MAX_LATENCY = 0.5
+
+def worker(poller, count, latencies):
+    """ Schedule count callbacks, one after the other """
+    done = threading.Event()
+    for _ in range(count):
+        done.clear()
+        begin = ticks()
+        poller.call_soon_threadsafe(done.set)
+        done.wait()
+        latencies.append(ticks() - begin)
+
+def main(args):
+    """ Main function """
+    nthreads, count = 8, 30
+
+    try:
+        options, _ = getopt.getopt(args[1:], "n:t:")
+    except getopt.error:
+        sys.exit("usage: examples/bench_waker.py [-n count] [-t threads]")
+    for name, value in options:
+        if name == "-n":
+            count = int(value)
+        elif name == "-t":
+            nthreads = int(value)
+
+    poller = Poller(persistent=True)
+    latencies = []
+    threads = [threading.Thread(target=worker,
+                                args=(poller, count, latencies))
+               for _ in range(nthreads)]
+
+    def join():
+        """ Stop the poller when the workers are done """
+        for thread in threads:
+            thread.join()
+        poller.call_soon_threadsafe(poller.break_loop)
+
+    poller.call_soon(lambda: [thread.start() for thread in threads])
+    poller.call_soon(threading.Thread(target=join).start)
+    poller.loop()
+
+    latencies.sort()
+    slow = len([value for value in latencies if value > MAX_LATENCY])
+    sys.stdout.write("calls %d p50 %.6f p99 %.6f max %.6f slow %d\n" % (
+        len(latencies), latencies[len(latencies) // 2],
+        latencies[len(latencies) * 99 // 100], latencies[-1], slow))
+    if slow:
+        sys.exit("bench_waker: %d wakeups lost" % slow)
+
+if __name__ == "__main__":
+    main(sys.argv)
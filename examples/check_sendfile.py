@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Check that queued file objects are sent as read() returns them """
+
+#
+# A stream sends a regular file with sendfile(), bypassing read().  This
+# is wrong for file objects that transform the bytes of the file, e.g.
+# a GzipFile, whose fileno() is the compressed file.  So we queue a few
+# kinds of file objects on a stream connected to a stream that collects
+# what it receives, and we fail if that differs from what read() says.
+#
+
+import bz2
+import gzip
+import io
+import logging
+import os
+import sys
+import tempfile
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot_runtime.poller import Poller
+from neubot_runtime.stream import Stream
+from neubot_runtime.stream_handler import StreamHandler
+
+class SenderStream(Stream):
+    """ Stream that sends a file object and closes """
+
+    def connection_made(self):
+        self.start_send(self.parent.fileobj)
+        self.close()
+
+class CollectorStream(Stream):
+    """ Stream that collects what it receives """
+
+    def connection_made(self):
+        self.start_recv()
+
+    def recv_complete(self, octets):
+        self.parent.received.append(bytes(octets))
+        self.start_recv()
+
+class CheckHandler(StreamHandler):
+    """ Creates either the sender or the collector """
+
+    def __init__(self, poller, factory, fileobj=None):
+        StreamHandler.__init__(self, poller)
+        self.factory = factory
+        self.fileobj = fileobj
+        self.received = []
+
+    def connection_made(self, sock, endpoint, rtt):
+        self.factory(self.poller).attach(self, sock, self.conf)
+
+    def connection_lost(self, stream):
+        if self.factory is CollectorStream:
+            self.poller.break_loop()
+
+def transfer(fileobj, port):
+    """ Send fileobj over a connection and return what was received """
+    poller = Poller()
+    collector = CheckHandler(poller, CollectorStream)
+    collector.configure({})
+    collector.listen(("127.0.0.1", port))
+    sender = CheckHandler(poller, SenderStream, fileobj)
+    sender.configure({})
+    sender.connect(("127.0.0.1", port))
+    poller.loop()
+    return b"".join(collector.received)
+
+def main():
+    """ Main function """
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    payload = b"".join(b"%08d neubot\n" % index for index in range(200000))
+    tmpdir = tempfile.mkdtemp()
+
+    plain = os.path.join(tmpdir, "plain")
+    with open(plain, "wb") as filep:
+        filep.write(payload)
+    compressed = os.path.join(tmpdir, "compressed.gz")
+    with gzip.open(compressed, "wb") as filep:
+        filep.write(payload)
+    bzipped = os.path.join(tmpdir, "compressed.bz2")
+    with bz2.BZ2File(bzipped, "wb") as filep:
+        filep.write(payload)
+
+    checks = (
+        ("open(rb)", lambda: open(plain, "rb")),
+        ("io.FileIO", lambda: io.FileIO(plain, "rb")),
+        ("GzipFile", lambda: gzip.open(compressed, "rb")),
+        ("BZ2File", lambda: bz2.BZ2File(bzipped, "rb")),
+    )
+    failed = 0
+    for index, (name, factory) in enumerate(checks):
+        fileobj = factory()
+        received = transfer(fileobj, str(54500 + index))
+        fileobj.close()
+        status = "ok" if received == payload else "FAIL"
+        if received != payload:
+            failed += 1
+        sys.stdout.write("%-10s sent %d expected %d %s\n" % (
+            name, len(received), len(payload), status))
+
+    for name in os.listdir(tmpdir):
+        os.unlink(os.path.join(tmpdir, name))
+    os.rmdir(tmpdir)
+    if failed:
+        sys.exit("check_sendfile: %d checks failed" % failed)
+
+if __name__ == "__main__":
+    main()
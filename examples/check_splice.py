@@ -0,0 +1,150 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Check that HttpStream moves bodies into sinks correctly """
+
+#
+# The HTTP parser does not run on Python 3 yet, while splice() needs
+# Python 3.10 or newer, so we cannot exercise the splice path of the
+# body sink using real HTTP messages.  Instead, we put the receiving
+# stream in the state it would be in after got_end_of_headers() for a
+# BOUNDED body, and then we let recv_complete(), which only slices the
+# body, do the rest.  We check regular files (using splice() where it
+# is available), file objects that are not regular files, and wrappers
+# like GzipFile (using write()), with and without drain mode.
+#
+
+import gzip
+import io
+import logging
+import os
+import sys
+import tempfile
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot_runtime.http_states import BOUNDED
+from neubot_runtime.http_stream import HttpStream
+from neubot_runtime.poller import Poller
+from neubot_runtime.stream import Stream
+from neubot_runtime.stream_handler import StreamHandler
+
+class UploadStream(HttpStream):
+    """ Stream receiving a BOUNDED body into a sink """
+
+    def connection_made(self):
+        self.state, self.left = BOUNDED, len(self.parent.payload)
+        self.set_body_sink(self.parent.sink)
+        self.start_recv()
+
+    def got_end_of_body(self):
+        self.parent.spliced = self._pipe is not None
+        self.parent.complete = True
+        self.close()
+
+class SenderStream(Stream):
+    """ Stream that sends the payload """
+
+    def connection_made(self):
+        self.start_send(self.parent.payload)
+
+class CheckHandler(StreamHandler):
+    """ Creates either the sender or the receiver """
+
+    def __init__(self, poller, factory, payload, sink=None):
+        StreamHandler.__init__(self, poller)
+        self.factory = factory
+        self.payload = payload
+        self.sink = sink
+        self.spliced = False
+        self.complete = False
+
+    def connection_made(self, sock, endpoint, rtt):
+        self.factory(self.poller).attach(self, sock, self.conf)
+
+    def connection_lost(self, stream):
+        if self.factory is UploadStream:
+            self.poller.break_loop()
+
+def transfer(payload, sink, port, edge_triggered, conf):
+    """ Upload payload into sink and return the receiver handler """
+    poller = Poller(edge_triggered=edge_triggered)
+    receiver = CheckHandler(poller, UploadStream, payload, sink)
+    receiver.configure(conf)
+    receiver.listen(("127.0.0.1", port))
+    sender = CheckHandler(poller, SenderStream, payload)
+    sender.configure({})
+    sender.connect(("127.0.0.1", port))
+    poller.loop()
+    return receiver
+
+def main():
+    """ Main function """
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    payload = os.urandom(8 << 20)
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "sink")
+
+    def read_plain(sink):
+        """ Read back a plain sink """
+        sink.seek(0)
+        return sink.read()
+
+    def read_gzip(sink):
+        """ Read back a gzip sink """
+        sink.close()
+        with gzip.open(path, "rb") as filep:
+            return filep.read()
+
+    checks = (
+        ("file", lambda: open(path, "wb+"), read_plain),
+        ("BytesIO", io.BytesIO, read_plain),
+        ("GzipFile", lambda: gzip.open(path, "wb"), read_gzip),
+    )
+    modes = (
+        ("level", False, {}),
+        ("drain-et", True, {"net.stream.drain": True,
+                            "net.stream.drain_budget": 1 << 18}),
+    )
+    failed, port = 0, 54600
+    for name, factory, read_back in checks:
+        for mode, edge_triggered, conf in modes:
+            sink = factory()
+            receiver = transfer(payload, sink, str(port), edge_triggered,
+                                conf)
+            port += 1
+            ok = receiver.complete and read_back(sink) == payload
+            if not sink.closed:
+                sink.close()
+            if not ok:
+                failed += 1
+            sys.stdout.write("%-9s %-9s splice %-5s %s\n" % (name, mode,
+                             receiver.spliced, "ok" if ok else "FAIL"))
+
+    if os.path.exists(path):
+        os.unlink(path)
+    os.rmdir(tmpdir)
+    if failed:
+        sys.exit("check_splice: %d checks failed" % failed)
+
+if __name__ == "__main__":
+    main()
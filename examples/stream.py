@@ -47,6 +47,15 @@ class EchoStream(Stream):
     def send_complete(self):
         logging.debug("send complete")
 
+    def pause_writing(self):
+        # The peer does not read as fast as it writes: stop reading
+        logging.debug("pause writing")
+        self.pause_reading()
+
+    def resume_writing(self):
+        logging.debug("resume writing")
+        self.resume_reading()
+
 class ChargenStream(Stream):
     """ Stream implementing the chargen protocol """
 
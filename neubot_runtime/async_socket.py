@@ -21,18 +21,51 @@
 
 """ Async socket """
 
+#
+# Would-block is the common failure on busy servers, so we catch it
+# first, using BlockingIOError on Python 3, and we return preallocated
+# results for all the failures, so that the hot path neither inspects
+# errno nor builds tuples.  We still build a tuple when we move data.
+# See examples/bench_async_socket.py for a microbenchmark.
+#
+
 import errno
 import logging
+import os
 import socket
+import struct
+import sys
 
 from .pollable import SUCCESS
 from .pollable import WANT_READ
 from .pollable import WANT_WRITE
 from .pollable import CONNRST
 
+try:
+    _BlockingIOError = BlockingIOError
+except NameError:
+    class _BlockingIOError(Exception):
+        """ Never raised on Python 2, where we check errno """
+
 # Soft errors on sockets, i.e. we can retry later
 SOFT_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
 
+# Zero-copy send on Linux (see the kernel's msg_zerocopy documentation)
+SO_ZEROCOPY = getattr(socket, "SO_ZEROCOPY", 60)
+MSG_ZEROCOPY = getattr(socket, "MSG_ZEROCOPY", 0x4000000)
+SO_EE_ORIGIN_ZEROCOPY = 5
+SO_EE_CODE_ZEROCOPY_COPIED = 1
+
+# Preallocated results
+_RECV_WANT_READ = (WANT_READ, b"")
+_RECV_CONNRST = (CONNRST, b"")
+_RECV_INTO_WANT_READ = (WANT_READ, 0)
+_RECV_INTO_CONNRST = (CONNRST, 0)
+_SEND_WANT_WRITE = (WANT_WRITE, 0)
+_SEND_CONNRST = (CONNRST, 0)
+_ZEROCOPY_WANT_WRITE = (WANT_WRITE, 0, False)
+_ZEROCOPY_CONNRST = (CONNRST, 0, False)
+
 class AsyncSocket(object):
     """ Async socket """
 
@@ -49,25 +82,159 @@ class AsyncSocket(object):
     def sorecv(self, maxlen):
         """ Receive from this socket """
         try:
-            octets = self._sock.recv(maxlen)
-            return SUCCESS, octets
+            return SUCCESS, self._sock.recv(maxlen)
+        except _BlockingIOError:
+            return _RECV_WANT_READ
+        except socket.error as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return _RECV_WANT_READ
+            elif exception.args[0] == errno.ECONNRESET:
+                return _RECV_CONNRST
+            else:
+                raise
+
+    def sorecv_into(self, buff, maxlen=0):
+        """ Receive from this socket into buff """
+        try:
+            return SUCCESS, self._sock.recv_into(buff, maxlen)
+        except _BlockingIOError:
+            return _RECV_INTO_WANT_READ
+        except socket.error as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return _RECV_INTO_WANT_READ
+            elif exception.args[0] == errno.ECONNRESET:
+                return _RECV_INTO_CONNRST
+            else:
+                raise
+
+    def can_sendmsg(self):
+        """ Return True if this socket supports sosendmsg() """
+        return hasattr(self._sock, "sendmsg")
+
+    def sosendmsg(self, buffers):
+        """ Send the buffers on this socket with a single syscall """
+        try:
+            return SUCCESS, self._sock.sendmsg(buffers)
+        except _BlockingIOError:
+            return _SEND_WANT_WRITE
         except socket.error as exception:
             if exception.args[0] in SOFT_ERRORS:
-                return WANT_READ, b""
+                return _SEND_WANT_WRITE
             elif exception.args[0] == errno.ECONNRESET:
-                return CONNRST, b""
+                return _SEND_CONNRST
             else:
                 raise
 
+    def can_sendfile(self):
+        """ Return True if this socket supports sosendfile() """
+        return hasattr(os, "sendfile") and isinstance(self._sock,
+                                                      socket.socket)
+
+    def sosendfile(self, fileno, offset, count):
+        """ Send count bytes of the file fileno starting at offset """
+        try:
+            return SUCCESS, os.sendfile(self._sock.fileno(), fileno,
+                                        offset, count)
+        except _BlockingIOError:
+            return _SEND_WANT_WRITE
+        except (socket.error, OSError) as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return _SEND_WANT_WRITE
+            elif exception.args[0] == errno.ECONNRESET:
+                return _SEND_CONNRST
+            else:
+                raise
+
+    def can_splice(self):
+        """ Return True if this socket supports sosplice() """
+        return hasattr(os, "splice") and isinstance(self._sock,
+                                                    socket.socket)
+
+    def sosplice(self, fileno, count):
+        """ Move up to count bytes from this socket to the pipe fileno """
+        try:
+            return SUCCESS, os.splice(self._sock.fileno(), fileno, count,
+                                      flags=os.SPLICE_F_MOVE |
+                                      os.SPLICE_F_NONBLOCK)
+        except _BlockingIOError:
+            return _RECV_INTO_WANT_READ
+        except (socket.error, OSError) as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return _RECV_INTO_WANT_READ
+            elif exception.args[0] == errno.ECONNRESET:
+                return _RECV_INTO_CONNRST
+            else:
+                raise
+
+    def enable_zerocopy(self):
+        """ Enable MSG_ZEROCOPY sends and return True on success """
+        # We need recvmsg() to read the completions, e.g. Python 2
+        # sockets do not have it
+        if (not sys.platform.startswith("linux") or
+                not isinstance(self._sock, socket.socket) or
+                not hasattr(self._sock, "recvmsg")):
+            return False
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+        except socket.error:
+            return False
+        return True
+
+    def sosend_zerocopy(self, octets):
+        """ Send on this socket without copying octets, and return the
+            status, the count and whether zero-copy was used: if so,
+            octets must not change until the kernel reports the send as
+            completed """
+        try:
+            return SUCCESS, self._sock.send(octets, MSG_ZEROCOPY), True
+        except _BlockingIOError:
+            return _ZEROCOPY_WANT_WRITE
+        except socket.error as exception:
+            if exception.args[0] in SOFT_ERRORS:
+                return _ZEROCOPY_WANT_WRITE
+            elif exception.args[0] == errno.ENOBUFS:
+                # We pinned too much memory: send copying the data
+                status, count = self.sosend(octets)
+                return status, count, False
+            elif exception.args[0] == errno.ECONNRESET:
+                return _ZEROCOPY_CONNRST
+            else:
+                raise
+
+    def zerocopy_completions(self):
+        """ Read the error queue and return the (first, last, copied)
+            ranges of the identifiers of completed zero-copy sends """
+        result = []
+        while True:
+            try:
+                _, ancdata, _, _ = self._sock.recvmsg(0, 1024,
+                                                      socket.MSG_ERRQUEUE)
+            except _BlockingIOError:
+                break
+            except socket.error as exception:
+                if exception.args[0] in SOFT_ERRORS:
+                    break
+                raise
+            for _, _, data in ancdata:
+                if len(data) < 16:
+                    continue
+                _, origin, _, code, _, first, last = struct.unpack(
+                    "=IBBBBII", data[:16])
+                if origin == SO_EE_ORIGIN_ZEROCOPY:
+                    result.append((first, last, bool(
+                        code & SO_EE_CODE_ZEROCOPY_COPIED)))
+        return result
+
     def sosend(self, octets):
         """ Send on this socket """
         try:
-            count = self._sock.send(octets)
-            return SUCCESS, count
+            return SUCCESS, self._sock.send(octets)
+        except _BlockingIOError:
+            return _SEND_WANT_WRITE
         except socket.error as exception:
             if exception.args[0] in SOFT_ERRORS:
-                return WANT_WRITE, 0
+                return _SEND_WANT_WRITE
             elif exception.args[0] == errno.ECONNRESET:
-                return CONNRST, 0
+                return _SEND_CONNRST
             else:
                 raise
@@ -0,0 +1,437 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Run streams on top of an asyncio event loop '''
+
+#
+# AsyncioPoller implements the interface of the Poller on top of an
+# asyncio event loop (including uvloop-style loops), so that Stream,
+# HttpServer and HttpClient can be embedded in asyncio applications
+# without running two loops.  Monitoring a file descriptor maps onto
+# loop.add_reader() and loop.add_writer(), and timers map onto the
+# loop's timers:
+#
+#     poller = AsyncioPoller(loop)
+#     server = HttpServer(poller)
+#     server.listen(("127.0.0.1", 8080))
+#     loop.run_forever()
+#
+# Alternatively, StreamProtocol allows the same handlers to work with
+# asyncio transports (e.g. those returned by loop.create_server()):
+#
+#     await loop.create_server(lambda: StreamProtocol(poller, server),
+#                              "127.0.0.1", 8080)
+#
+# In this case the stream gets a TransportSocket, which looks like a
+# nonblocking socket to AsyncSocket: recv() returns the data buffered
+# by the protocol or fails with EAGAIN, and send() writes into the
+# transport.  AsyncioPoller knows about transport sockets and does not
+# call add_reader() for them; it dispatches the read and write events
+# when the protocol has data and when the transport can be written.
+#
+
+import asyncio
+import collections
+import errno
+import logging
+import socket
+
+from .poller import CHECK_TIMEOUT
+from .poller import Poller
+from .timing_wheel import TimingWheel
+from .utils import ticks
+from .utils import timestamp
+
+# Pause reading from the transport when we buffer more than this
+MAXBUFFERED = 1 << 18
+
+class AsyncioPoller(object):
+    ''' Poller running on top of an asyncio event loop '''
+
+    def __init__(self, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._readset = {}
+        self._writeset = {}
+        self._transports = {}
+        self.tracer = None
+        self._wheel = TimingWheel(ticks(), CHECK_TIMEOUT)
+        self._loop.call_later(CHECK_TIMEOUT, self._check_timeout)
+
+    def configure(self, conf):
+        ''' Configure this object '''
+
+    def get_stats(self):
+        ''' Return a dictionary containing the poller counters '''
+        return {}
+
+    def get_metrics(self):
+        ''' Latency histograms are not available on asyncio '''
+        return None
+
+    def get_stall_report(self, count=10):
+        ''' Use the debug mode of asyncio to find stalls '''
+        return None
+
+    def load(self):
+        ''' Return the number of file descriptors we are monitoring '''
+        return len(set(self._readset) | set(self._writeset))
+
+    def edge_triggered(self):
+        ''' asyncio loops are level-triggered '''
+        return False
+
+    def charge(self, count):
+        ''' Account for count bytes moved by the current callback '''
+
+    # Timers
+
+    def call_soon(self, func, *args):
+        ''' Call func(*args) at the next iteration of the loop '''
+        return self._loop.call_soon(func, *args)
+
+    def call_soon_threadsafe(self, func, *args):
+        ''' Like call_soon() but safe to call from any thread '''
+        return self._loop.call_soon_threadsafe(func, *args)
+
+    def call_at(self, when, func, *args):
+        ''' Call func(*args) at the ticks() time when '''
+        return self._loop.call_later(max(0.0, when - ticks()), func, *args)
+
+    def call_later(self, delay, func, *args):
+        ''' Call func(*args) after delay seconds '''
+        return self._loop.call_later(delay, func, *args)
+
+    def sched(self, delta, func, *args):
+        ''' Schedule task '''
+        self._loop.call_later(delta, Poller._run_task, func, args)
+        return timestamp() + delta
+
+    def run_in_executor(self, func, *args, **kwargs):
+        ''' Run func(*args) in the default executor of the loop and
+            then invoke callback(result, exception) on the loop '''
+        callback = kwargs.get("callback")
+        future = self._loop.run_in_executor(None, func, *args)
+        if callback:
+            def deliver(future):
+                ''' Deliver the result to the callback '''
+                if future.cancelled():
+                    callback(None, asyncio.CancelledError())
+                elif future.exception() is not None:
+                    callback(None, future.exception())
+                else:
+                    callback(future.result(), None)
+            future.add_done_callback(deliver)
+        return future
+
+    # Monitoring
+
+    def register_transport(self, tsock):
+        ''' Tell us that tsock's fileno is driven by a transport '''
+        self._transports[tsock.fileno()] = tsock
+
+    def unregister_transport(self, tsock):
+        ''' Tell us that tsock's transport is gone '''
+        self._transports.pop(tsock.fileno(), None)
+
+    def set_readable(self, stream):
+        ''' Monitor for readability '''
+        fileno = stream.fileno()
+        if fileno not in self._readset:
+            self._readset[fileno] = stream
+            if fileno in self._transports:
+                self._transports[fileno].want_read(True)
+            else:
+                self._loop.add_reader(fileno, self._call_handle_read, fileno)
+            self._wheel.add(stream)
+
+    def set_writable(self, stream):
+        ''' Monitor for writability '''
+        fileno = stream.fileno()
+        if fileno not in self._writeset:
+            self._writeset[fileno] = stream
+            if fileno in self._transports:
+                self._transports[fileno].want_write(True)
+            else:
+                self._loop.add_writer(fileno, self._call_handle_write, fileno)
+            self._wheel.add(stream)
+
+    def unset_readable(self, stream):
+        ''' Stop monitoring for readability '''
+        fileno = stream.fileno()
+        if fileno in self._readset:
+            del self._readset[fileno]
+            if fileno in self._transports:
+                self._transports[fileno].want_read(False)
+            else:
+                self._loop.remove_reader(fileno)
+            if fileno not in self._writeset:
+                self._wheel.remove(stream)
+
+    def unset_writable(self, stream):
+        ''' Stop monitoring for writability '''
+        fileno = stream.fileno()
+        if fileno in self._writeset:
+            del self._writeset[fileno]
+            if fileno in self._transports:
+                self._transports[fileno].want_write(False)
+            else:
+                self._loop.remove_writer(fileno)
+            if fileno not in self._readset:
+                self._wheel.remove(stream)
+
+    def forget(self, stream):
+        ''' Immediately stop monitoring stream '''
+        self.unset_readable(stream)
+        self.unset_writable(stream)
+
+    def close(self, stream):
+        ''' Safely close a stream '''
+        self.forget(stream)
+        try:
+            stream.handle_close()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            logging.error('poller: handle_close() failed', exc_info=1)
+
+    def _call_handle_read(self, fileno):
+        ''' Safely dispatch read event '''
+        if fileno in self._readset:
+            stream = self._readset[fileno]
+            try:
+                stream.handle_read()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error('poller: handle_read() failed', exc_info=1)
+                self.close(stream)
+
+    def _call_handle_write(self, fileno):
+        ''' Safely dispatch write event '''
+        if fileno in self._writeset:
+            stream = self._writeset[fileno]
+            try:
+                stream.handle_write()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error('poller: handle_write() failed', exc_info=1)
+                self.close(stream)
+
+    # Loop
+
+    def break_loop(self):
+        ''' Break out of poller loop '''
+        self._loop.stop()
+
+    def loop(self):
+        ''' Run the asyncio loop until break_loop() '''
+        try:
+            self._loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def _check_timeout(self):
+        ''' Dispatch the periodic event '''
+        self._loop.call_later(CHECK_TIMEOUT, self._check_timeout)
+        timenow = ticks()
+        for stream in self._wheel.expire(timenow):
+            if stream._wheel is not self._wheel:
+                continue
+            if stream.handle_periodic(timenow):
+                logging.debug('poller: watchdog timeout: %s', str(stream))
+                self.close(stream)
+            else:
+                self._wheel.rearm(stream)
+
+class TransportSocket(object):
+    ''' Nonblocking-socket lookalike on top of an asyncio transport '''
+
+    def __init__(self, poller, transport):
+        self._poller = poller
+        self._transport = transport
+        self._fileno = transport.get_extra_info("socket").fileno()
+        self._buffer = collections.deque()
+        self._buffered = 0
+        self._eof = False
+        self._error = None
+        self._want_read = False
+        self._want_write = False
+        self._writing_paused = False
+        self._scheduled_read = False
+        self._scheduled_write = False
+
+    def fileno(self):
+        ''' Return the file descriptor of the transport '''
+        return self._fileno
+
+    def getsockname(self):
+        ''' Return the local address '''
+        return self._transport.get_extra_info("sockname")
+
+    def getpeername(self):
+        ''' Return the remote address '''
+        return self._transport.get_extra_info("peername")
+
+    def setblocking(self, flag):
+        ''' Transports are always nonblocking '''
+
+    def recv(self, maxlen):
+        ''' Return buffered data or fail with EAGAIN '''
+        if not self._buffer:
+            if self._error:
+                raise socket.error(errno.ECONNRESET, "Connection reset")
+            if self._eof:
+                return b""
+            raise socket.error(errno.EAGAIN, "Resource temporarily unavailable")
+        octets = self._buffer.popleft()
+        if len(octets) > maxlen:
+            self._buffer.appendleft(octets[maxlen:])
+            octets = octets[:maxlen]
+        self._buffered -= len(octets)
+        if self._buffered < MAXBUFFERED // 2 and not self._eof:
+            self._transport.resume_reading()
+        return octets
+
+    def recv_into(self, buff, maxlen=0):
+        ''' Like recv() but copy the data into buff '''
+        if not maxlen:
+            maxlen = len(buff)
+        octets = self.recv(maxlen)
+        count = len(octets)
+        buff[:count] = octets
+        return count
+
+    def send(self, octets):
+        ''' Write octets into the transport '''
+        if self._eof or self._error or self._transport.is_closing():
+            raise socket.error(errno.ECONNRESET, "Connection reset")
+        self._transport.write(bytes(octets))
+        return len(octets)
+
+    def close(self):
+        ''' Close the transport '''
+        self._poller.unregister_transport(self)
+        self._transport.close()
+
+    # Glue with the protocol and the poller
+
+    def want_read(self, flag):
+        ''' Called by the poller when interest in reading changes '''
+        self._want_read = flag
+        self._schedule_read()
+
+    def want_write(self, flag):
+        ''' Called by the poller when interest in writing changes '''
+        self._want_write = flag
+        self._schedule_write()
+
+    def _schedule_read(self):
+        ''' Dispatch the read event at the next iteration, if needed '''
+        if (self._want_read and not self._scheduled_read and
+                (self._buffer or self._eof or self._error)):
+            self._scheduled_read = True
+            self._poller.call_soon(self._dispatch_read)
+
+    def _schedule_write(self):
+        ''' Dispatch the write event at the next iteration, if needed '''
+        if (self._want_write and not self._scheduled_write and
+                not self._writing_paused):
+            self._scheduled_write = True
+            self._poller.call_soon(self._dispatch_write)
+
+    def _dispatch_read(self):
+        ''' Dispatch the read event '''
+        self._scheduled_read = False
+        if self._want_read:
+            self._poller._call_handle_read(self._fileno)
+            self._schedule_read()
+
+    def _dispatch_write(self):
+        ''' Dispatch the write event '''
+        self._scheduled_write = False
+        if self._want_write and not self._writing_paused:
+            self._poller._call_handle_write(self._fileno)
+            self._schedule_write()
+
+    def data_received(self, data):
+        ''' Called by the protocol when data arrives '''
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= MAXBUFFERED:
+            self._transport.pause_reading()
+        self._schedule_read()
+
+    def eof_received(self):
+        ''' Called by the protocol on EOF '''
+        self._eof = True
+        self._schedule_read()
+
+    def connection_lost(self, exception):
+        ''' Called by the protocol when the connection is lost '''
+        if exception is not None:
+            self._error = exception
+        else:
+            self._eof = True
+        self._schedule_read()
+        self._schedule_write()
+
+    def pause_writing(self):
+        ''' Called by the protocol when the transport is full '''
+        self._writing_paused = True
+
+    def resume_writing(self):
+        ''' Called by the protocol when the transport drained '''
+        self._writing_paused = False
+        self._schedule_write()
+
+class StreamProtocol(asyncio.Protocol):
+    ''' asyncio protocol delivering connections to a StreamHandler '''
+
+    def __init__(self, poller, handler):
+        self._poller = poller
+        self._handler = handler
+        self._tsock = None
+        self._stream = None
+
+    def connection_made(self, transport):
+        self._tsock = TransportSocket(self._poller, transport)
+        self._poller.register_transport(self._tsock)
+        endpoint = transport.get_extra_info("sockname")
+        self._handler.connection_made(self._tsock, endpoint, 0)
+
+    def data_received(self, data):
+        self._tsock.data_received(data)
+
+    def eof_received(self):
+        self._tsock.eof_received()
+        return False
+
+    def connection_lost(self, exception):
+        self._tsock.connection_lost(exception)
+
+    def pause_writing(self):
+        self._tsock.pause_writing()
+
+    def resume_writing(self):
+        self._tsock.resume_writing()
@@ -0,0 +1,68 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Pool of preallocated receive buffers '''
+
+#
+# Calling recv(MAXBUF) allocates a MAXBUF-sized object for every read,
+# even when a few bytes arrive, and then shrinks it.  Instead, streams
+# receive into a buffer taken from this pool, and give it back as soon
+# as the received data has been copied out or consumed, so that few
+# buffers are ever allocated regardless of the number of streams.
+#
+# The pool only keeps up to `max_free` idle buffers, so that a burst of
+# concurrent users does not pin memory forever.  Acquiring and releasing
+# use atomic deque operations, hence the pool is safe to share among the
+# threads of a PollerPool.
+#
+
+import collections
+
+# Size of the buffers (the same as stream.MAXBUF)
+BUFSIZE = 1 << 18
+
+# Maximum number of idle buffers we keep
+MAX_FREE = 16
+
+class BufferPool(object):
+    ''' Pool of preallocated bytearrays '''
+
+    def __init__(self, size=BUFSIZE, max_free=MAX_FREE):
+        self.size = size
+        self.max_free = max_free
+        self._free = collections.deque()
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self):
+        ''' Return an idle buffer, or a new one if there are none '''
+        try:
+            return self._free.pop()
+        except IndexError:
+            return bytearray(self.size)
+
+    def release(self, buff):
+        ''' Give back a buffer obtained with acquire() '''
+        if len(self._free) < self.max_free:
+            self._free.append(buff)
+
+BUFFER_POOL = BufferPool()
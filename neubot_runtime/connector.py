@@ -48,7 +48,7 @@ class Connector(Pollable):
     def _connection_failed(self):
         """ Internally called when connection fails """
         if self.sock:
-            self.poller.unset_writable(self)
+            self.poller.forget(self)
             self.sock = None
         if not self.epnts:
             self.parent.connection_failed(self, None)
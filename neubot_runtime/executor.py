@@ -0,0 +1,156 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Run blocking functions off the poller loop '''
+
+#
+# A PollerExecutor wraps a concurrent.futures executor and delivers
+# the results back on the thread running the poller, by the means of
+# call_soon_threadsafe().  The callback receives the result and the
+# exception (one of them is always None).
+#
+# We keep track of the number of pending tasks (the queue depth), and
+# of the time tasks spend waiting for a worker and running, so that it
+# is easy to see whether the pool is too small.
+#
+# When `max_pending` is nonzero, submit() refuses new tasks (and returns
+# None) while that many tasks are pending.  This is the backpressure
+# mechanism: the caller should retry later or do the work inline.  It
+# matters mostly for pools of processes, where tasks and their results
+# are serialized and queued in memory until a worker is free.
+#
+# Tasks for a pool of processes must be picklable, i.e. the function
+# must be defined at the top level of a module, and the arguments and
+# the result must be picklable as well.
+#
+
+import logging
+import multiprocessing
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None  # Python 2 without the `futures` backport
+
+from .utils import ticks
+
+def _run_timed(func, args):
+    ''' Run func(*args) in a worker and measure when it started '''
+    started = ticks()
+    return func(*args), started, ticks()
+
+class PollerExecutor(object):
+    ''' Deliver the results of an executor on the poller loop '''
+
+    def __init__(self, poller, executor, max_pending=0):
+        self._poller = poller
+        self._executor = executor
+        self._max_pending = max_pending
+        self._pending = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "pending_max": 0,
+            "wait_time": 0.0,
+            "run_time": 0.0,
+            "latency_max": 0.0,
+        }
+
+    def pending(self):
+        ''' Return the number of tasks not delivered yet '''
+        return self._pending
+
+    def full(self):
+        ''' Return True if submit() would refuse new tasks '''
+        return bool(self._max_pending) and self._pending >= self._max_pending
+
+    def get_stats(self, prefix):
+        ''' Return counters, with names prefixed by prefix '''
+        result = {}
+        for key, value in self._stats.items():
+            result[prefix + key] = value
+        result[prefix + "pending"] = self._pending
+        return result
+
+    def submit(self, func, args, callback):
+        ''' Run func(*args) in the executor and then, on the
+            poller loop, callback(result, exception).  Returns the
+            future or None if there are too many pending tasks. '''
+        if self.full():
+            self._stats["rejected"] += 1
+            return None
+        submitted = ticks()
+        future = self._executor.submit(_run_timed, func, args)
+        self._pending += 1
+        self._stats["submitted"] += 1
+        self._stats["pending_max"] = max(self._stats["pending_max"],
+                                         self._pending)
+        future.add_done_callback(lambda future:
+            self._poller.call_soon_threadsafe(self._deliver, future,
+                                              submitted, callback))
+        return future
+
+    def _deliver(self, future, submitted, callback):
+        ''' Deliver the result of future on the poller loop '''
+        self._pending -= 1
+        self._stats["latency_max"] = max(self._stats["latency_max"],
+                                         ticks() - submitted)
+
+        result, exception = None, None
+        if future.cancelled():
+            exception = futures.CancelledError()
+        else:
+            exception = future.exception()
+        if exception is None:
+            result, started, finished = future.result()
+            self._stats["completed"] += 1
+            self._stats["wait_time"] += started - submitted
+            self._stats["run_time"] += finished - started
+        else:
+            self._stats["failed"] += 1
+            if not callback:
+                logging.warning("executor: task failed: %s", exception)
+
+        if callback:
+            callback(result, exception)
+
+    def shutdown(self, wait=True):
+        ''' Shutdown the underlying executor '''
+        self._executor.shutdown(wait)
+
+def thread_pool(poller, workers):
+    ''' Create a PollerExecutor backed by a pool of threads '''
+    if futures is None:
+        raise RuntimeError("executor: concurrent.futures not available")
+    return PollerExecutor(poller, futures.ThreadPoolExecutor(workers))
+
+def process_pool(poller, workers=0, max_pending=0):
+    ''' Create a PollerExecutor backed by a pool of processes '''
+    if futures is None:
+        raise RuntimeError("executor: concurrent.futures not available")
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+    if max_pending <= 0:
+        max_pending = 4 * workers
+    return PollerExecutor(poller, futures.ProcessPoolExecutor(workers),
+                          max_pending)
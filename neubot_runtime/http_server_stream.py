@@ -73,6 +73,13 @@ class HttpServerStream(HttpStream):
         else:
             return ERROR, 0
 
+    def set_body_sink(self, fileobj):
+        ''' Write the body of the current request into fileobj, which
+            becomes the request body '''
+        HttpStream.set_body_sink(self, fileobj)
+        if self.request:
+            self.request.body = fileobj
+
     def got_piece(self, piece):
         ''' Invoked when we read a piece of the body '''
         if self.request:
@@ -0,0 +1,165 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Latency histograms of the poller loop '''
+
+#
+# When metrics are enabled (see `poller.metrics`) the poller measures:
+#
+# - iteration: the time between the return of the backend poll() and
+#   the next call to it, i.e. the time spent running callbacks;
+#
+# - ready_fds: the number of file descriptors returned by poll();
+#
+# - dispatch_delay: the time between poll() reporting that a file
+#   descriptor is ready and the dispatch of its callbacks, which grows
+#   when the budget carries file descriptors over;
+#
+# - callbacks: the wall time of each callback, keyed by the class of
+#   the stream and the callback name (e.g. `HttpServerStream.handle_read`)
+#   or, for timers and deferred calls, by the function name.
+#
+# Values go in histograms with power-of-two buckets, so that recording
+# costs a few operations and the memory is bounded.  Times are recorded
+# in microseconds.  Callbacks slower than `poller.slow_callback` seconds
+# are also logged.  When metrics are disabled the poller only pays for
+# a few `is not None` checks.
+#
+
+import logging
+
+# Number of buckets of each histogram (the last one is open ended)
+BUCKETS = 32
+
+# Log callbacks slower than this number of seconds
+SLOW_CALLBACK = 0.1
+
+class Histogram(object):
+    ''' Histogram with power-of-two buckets '''
+
+    #
+    # Bucket N holds the values V such that int(V).bit_length() is N,
+    # i.e. bucket 0 holds zero and bucket N > 0 holds [2^(N-1), 2^N).
+    #
+
+    __slots__ = ('buckets', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def add(self, value):
+        ''' Record value (which must not be negative) '''
+        self.buckets[min(int(value).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, fraction):
+        ''' Return an upper bound of the fraction-th percentile '''
+        if not self.count:
+            return 0
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(1 << index, self.maximum) if index else 0
+        return self.maximum
+
+    def to_dict(self):
+        ''' Return a dictionary describing this histogram '''
+        buckets = {}
+        for index, count in enumerate(self.buckets):
+            if count:
+                buckets[1 << index if index else 0] = count
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.maximum,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "buckets": buckets,
+        }
+
+def describe(func, args=()):
+    ''' Return a readable name for the callback func '''
+    if getattr(func, "__name__", None) == "_run_task" and args:
+        func = args[0]  # Task scheduled with Poller.sched()
+    name = getattr(func, "__name__", None) or func.__class__.__name__
+    owner = getattr(func, "__self__", None)
+    if owner is not None:
+        return "%s.%s" % (owner.__class__.__name__, name)
+    return name
+
+class LoopMetrics(object):
+    ''' Histograms of the poller loop '''
+
+    def __init__(self, slow_callback=SLOW_CALLBACK):
+        self.slow_callback = slow_callback
+        self.iteration = Histogram()
+        self.ready_fds = Histogram()
+        self.dispatch_delay = Histogram()
+        self.callbacks = {}
+        self.ready_since = {}
+        self._started = None
+
+    def begin_iteration(self, now, ready):
+        ''' The backend poll() returned ready file descriptors '''
+        self._started = now
+        self.ready_fds.add(ready)
+
+    def end_iteration(self, now):
+        ''' We are about to call the backend poll() again '''
+        if self._started is not None:
+            self.iteration.add(1000000 * (now - self._started))
+            self._started = None
+
+    def dispatched(self, fileno, now):
+        ''' The callbacks of fileno are about to run '''
+        since = self.ready_since.pop(fileno, None)
+        if since is not None:
+            self.dispatch_delay.add(1000000 * (now - since))
+
+    def callback(self, name, elapsed):
+        ''' The callback name ran for elapsed seconds '''
+        histogram = self.callbacks.get(name)
+        if histogram is None:
+            histogram = self.callbacks[name] = Histogram()
+        histogram.add(1000000 * elapsed)
+        if elapsed >= self.slow_callback:
+            logging.warning("poller: slow callback: %s took %.3f s",
+                            name, elapsed)
+
+    def to_dict(self):
+        ''' Return a dictionary describing all the histograms '''
+        callbacks = {}
+        for name, histogram in self.callbacks.items():
+            callbacks[name] = histogram.to_dict()
+        return {
+            "iteration": self.iteration.to_dict(),
+            "ready_fds": self.ready_fds.to_dict(),
+            "dispatch_delay": self.dispatch_delay.to_dict(),
+            "callbacks": callbacks,
+        }
@@ -29,12 +29,20 @@ from . import utils
 # Reclaim stream after 300 seconds
 WATCHDOG = 300
 
+# Priority classes, in dispatch order
+(PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW) = range(3)
+
 class Pollable(object):
     ''' Base class for pollable objects '''
 
     def __init__(self):
         self._created = utils.ticks()
         self._watchdog = WATCHDOG
+        self._wheel = None
+        self._wheel_slot = -1
+        self._priority = PRIORITY_NORMAL
+        # True if handlers read and write until EAGAIN (see poller.py)
+        self.edge_safe = False
 
     def fileno(self):
         ''' Return file descriptor number '''
@@ -52,7 +60,25 @@ class Pollable(object):
         ''' Handle the PERIODIC event '''
         return self._watchdog >= 0 and timenow - self._created > self._watchdog
 
+    def get_priority(self):
+        ''' Return the priority class of this pollable '''
+        return self._priority
+
+    def set_priority(self, priority):
+        ''' Set the priority class of this pollable '''
+        if priority not in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW):
+            raise ValueError("Invalid priority class")
+        self._priority = priority
+
+    def deadline(self):
+        ''' Return when the watchdog expires or None '''
+        if self._watchdog < 0:
+            return None
+        return self._created + self._watchdog
+
     def set_timeout(self, timeo):
         ''' Set timeout of this pollable '''
         self._created = utils.ticks()
         self._watchdog = timeo
+        if self._wheel is not None:
+            self._wheel.rearm(self)
@@ -21,46 +21,356 @@
 
 ''' Dispatch read, write, periodic and other events '''
 
+import collections
 import logging
 import errno
 import select
-import sched
-import sys
+import threading
 
+from .loop_metrics import LoopMetrics
+from .loop_metrics import SLOW_CALLBACK
+from .loop_metrics import describe
+from .pollable import PRIORITY_LOW
+from .stall_watchdog import StallWatchdog
 from .utils import ticks
 from .utils import timestamp
+from .timer_queue import Handle
+from .timer_queue import TimerQueue
+from .timing_wheel import TimingWheel
+from .tracer import Tracer
+from .waker import Waker
+from .third_party.six import OrderedDict
+from . import executor
+from . import poller_backend
+from . import tracer
+
+# Default number of threads used by run_in_executor()
+EXECUTOR_WORKERS = 4
 
 #
 # Number of seconds between each check for timed-out
-# I/O operations.
+# I/O operations.  This is also the resolution of the
+# timing wheel that indexes the streams' deadlines.
 #
-CHECK_TIMEOUT = 10
+CHECK_TIMEOUT = 1
 
-class Poller(sched.scheduler):
+class Poller(object):
 
     ''' Dispatch read, write, periodic and other events '''
 
     #
     # We always keep the _check_timeout() event registered
-    # so the scheduler is alive forever.
+    # so the timer queue is never empty.
     #
-    # We register self._poll() as the delay function and
-    # in that function we either invoke select() or we
-    # sleep for the requested amount of time.
+    # At each iteration we run the expired timers and the
+    # callbacks deferred using call_soon(), and then we call
+    # self._poll() with the time until the next timer as the
+    # timeout (or zero, if more callbacks were deferred in the
+    # meantime) and in that function we either wait for I/O
+    # using the backend or we sleep for that amount of time.
+    #
+    # The backend is one of epoll, poll and select (see the
+    # poller_backend module) and by default we use the best
+    # one available on this platform.  The backend keeps a
+    # persistent registration for each file descriptor, and
+    # we only talk to it when the interest changes.
+    #
+    # Interest changes are not applied immediately: we update
+    # readset and writeset, which drive the dispatching, and we
+    # remember which file descriptors changed.  Then, just before
+    # polling, we tell the backend about the net changes only.
+    # This way the stream code, which stops monitoring for reads
+    # after every recv() and starts again when the upper layer
+    # wants more data, does not cost two syscalls per read.
+    #
+    # Ready file descriptors are queued and dispatched in order,
+    # and each iteration may dispatch at most `budget_callbacks`
+    # I/O callbacks and move at most `budget_bytes` bytes (as
+    # reported by streams using charge()).  When we run out of
+    # budget the remaining file descriptors are carried over to
+    # the next iteration, ahead of the newly ready ones, so that a
+    # bulk stream cannot starve the other streams on the loop.
+    #
+    # There is one queue of ready file descriptors per priority
+    # class (see pollable.py) and we drain the queues in priority
+    # order.  Optionally, the time spent in callbacks of low
+    # priority streams is capped at `low_priority_slice` seconds
+    # per iteration, to keep control connections responsive while
+    # bulk transfers saturate the loop.
+    #
+    # We always monitor an internal waker for readability, so that
+    # other threads can interrupt the backend poll() when they queue
+    # callbacks using call_soon_threadsafe().  The waker does not
+    # count as pending I/O when deciding whether to exit the loop.
+    # A persistent poller, instead, never exits the loop because
+    # there is no pending I/O, but only when break_loop() is called,
+    # which is useful for pollers that get their work from other
+    # threads (see poller_pool.py).
+    #
+    # Blocking functions can run in a pool of threads, created on
+    # demand by run_in_executor(), which delivers their results back
+    # on the loop.  Likewise, CPU bound picklable tasks can run in a
+    # pool of processes using run_in_process().  Tasks that did not
+    # complete yet count as pending I/O, so that the loop does not
+    # exit while waiting for them.
+    #
+    # Optionally, we collect latency histograms of the loop and of
+    # the callbacks (see loop_metrics.py) that get_metrics() returns,
+    # and we run a thread that reports when the loop does not return
+    # to the backend for too long (see stall_watchdog.py).  Also, we
+    # can record the events of the loop into a ring buffer, which is
+    # exposed as the `tracer` attribute so that streams can record
+    # their reads and writes as well (see tracer.py).
     #
 
-    def __init__(self):
+    def __init__(self, backend=None, edge_triggered=False, persistent=False):
         ''' Initialize '''
-        sched.scheduler.__init__(self, ticks, self._poll)
         self._again = True
+        self._persistent = persistent
+        self._timers = TimerQueue()
+        self._ready = collections.deque()
         self._readset = {}
         self._writeset = {}
+        self._registered = {}
+        self._dirty = {}
+        self._ready_io = (OrderedDict(), OrderedDict(), OrderedDict())
+        self._budget_bytes = 0
+        self._budget_callbacks = 0
+        self._low_priority_slice = 0.0
+        self._spent_bytes = 0
+        self._stats = {
+            "budget_bytes_hit": 0,
+            "budget_callbacks_hit": 0,
+            "carried_over": 0,
+            "low_priority_capped": 0,
+        }
+        self._wheel = TimingWheel(ticks(), CHECK_TIMEOUT)
+        self._backend = poller_backend.create(backend)
+        self._edge_triggered = False
+        self._set_edge_triggered(edge_triggered)
+        self._waker = Waker()
+        self._executor_workers = EXECUTOR_WORKERS
+        self._thread_pool = None
+        self._process_workers = 0
+        self._process_max_pending = 0
+        self._process_pool = None
+        self._metrics = None
+        self._stall_watchdog = None
+        self._busy_since = None
+        self._loop_thread = None
+        self.tracer = None
+        self.set_readable(self._waker)
         self._check_timeout()
 
+    def configure(self, conf):
+        ''' Configure this object '''
+        backend = conf.get("poller.backend")
+        if backend and backend != self._backend.name:
+            self._switch_backend(poller_backend.create(backend))
+        if "poller.edge_triggered" in conf:
+            self._set_edge_triggered(conf["poller.edge_triggered"])
+        self._budget_bytes = int(conf.get("poller.budget_bytes",
+                                          self._budget_bytes))
+        self._budget_callbacks = int(conf.get("poller.budget_callbacks",
+                                              self._budget_callbacks))
+        self._low_priority_slice = float(conf.get(
+            "poller.low_priority_slice", self._low_priority_slice))
+        self._executor_workers = int(conf.get("poller.executor_workers",
+                                              self._executor_workers))
+        self._process_workers = int(conf.get("poller.process_workers",
+                                             self._process_workers))
+        self._process_max_pending = int(conf.get(
+            "poller.process_max_pending", self._process_max_pending))
+        if "poller.metrics" in conf:
+            self._metrics = None
+            if conf["poller.metrics"]:
+                self._metrics = LoopMetrics(float(conf.get(
+                    "poller.slow_callback", SLOW_CALLBACK)))
+        if "poller.trace" in conf:
+            self.tracer = None
+            if conf["poller.trace"]:
+                self.tracer = Tracer(int(conf.get("poller.trace_capacity",
+                                                  tracer.CAPACITY)))
+        if "poller.stall_threshold" in conf:
+            self._set_stall_threshold(float(conf["poller.stall_threshold"]))
+
+    def _set_stall_threshold(self, threshold):
+        ''' Start, reconfigure or stop the stall watchdog '''
+        if threshold <= 0:
+            if self._stall_watchdog:
+                self._stall_watchdog.stop()
+                self._stall_watchdog = None
+                self._busy_since = None
+        elif self._stall_watchdog:
+            self._stall_watchdog.threshold = threshold
+        else:
+            self._stall_watchdog = StallWatchdog(self, threshold)
+            self._stall_watchdog.start()
+            if self._loop_thread == threading.current_thread().ident:
+                # Started by a callback: the loop is busy right now
+                self._busy_since = ticks()
+
+    def get_stall_report(self, count=10):
+        ''' Return the count frames where the loop stalled most often,
+            as (frame, samples) pairs, or None if disabled '''
+        if self._stall_watchdog is None:
+            return None
+        return self._stall_watchdog.report(count)
+
+    def get_metrics(self):
+        ''' Return the latency histograms, or None if disabled '''
+        if self._metrics is None:
+            return None
+        return self._metrics.to_dict()
+
+    def get_stats(self):
+        ''' Return a dictionary containing the poller counters '''
+        stats = dict(self._stats)
+        if self._thread_pool:
+            stats.update(self._thread_pool.get_stats("executor_"))
+        if self._process_pool:
+            stats.update(self._process_pool.get_stats("process_"))
+        if self._stall_watchdog:
+            stats["stalls"] = self._stall_watchdog.stalls
+        return stats
+
+    def run_in_executor(self, func, *args, **kwargs):
+        ''' Run func(*args) in a pool of threads and then invoke the
+            `callback(result, exception)` keyword argument, if any, on
+            the poller loop.  Returns a concurrent.futures.Future. '''
+        if not self._thread_pool:
+            self._thread_pool = executor.thread_pool(self,
+                                                     self._executor_workers)
+        return self._thread_pool.submit(func, args, kwargs.get("callback"))
+
+    def run_in_process(self, func, *args, **kwargs):
+        ''' Like run_in_executor() but uses a pool of processes, hence
+            func and args must be picklable.  Returns None, without
+            running func, when too many tasks are pending. '''
+        if not self._process_pool:
+            self._process_pool = executor.process_pool(
+                self, self._process_workers, self._process_max_pending)
+        return self._process_pool.submit(func, args, kwargs.get("callback"))
+
+    def process_pool_full(self):
+        ''' Return True if run_in_process() would refuse new tasks '''
+        return bool(self._process_pool and self._process_pool.full())
+
+    def charge(self, count):
+        ''' Account for count bytes moved by the current callback '''
+        self._spent_bytes += count
+
+    #
+    # After fork() the child shares the backend (e.g. the epoll set)
+    # and the waker with the parent, so any change to them made by
+    # the child would affect the parent as well.  Therefore the child
+    # must call this method before using the poller, and we replace
+    # them without touching the old ones: we do not even flush the
+    # pending interest changes, but we register with the new backend
+    # what readset and writeset say, which includes those changes.
+    # Pools of workers do not survive fork() either.
+    #
+    def after_fork(self):
+        ''' Reinitialize the poller in a child process '''
+        backend, self._backend = self._backend, poller_backend.create(
+            self._backend.name)
+        backend.close()
+
+        waker, self._waker = self._waker, Waker()
+        fileno = waker.fileno()
+        del self._readset[fileno]
+        waker.handle_close()
+
+        registered, self._registered = self._registered, {}
+        self._dirty = {}
+        for _, owner in registered.values():
+            self._wheel.remove(owner)
+        for fileno in set(self._readset) | set(self._writeset):
+            self._update_interest(fileno, None)
+        self.set_readable(self._waker)
+
+        self._ready_io = (OrderedDict(), OrderedDict(), OrderedDict())
+        self._thread_pool = None
+        self._process_pool = None
+
+        if self._stall_watchdog:
+            self._stall_watchdog = StallWatchdog(
+                self, self._stall_watchdog.threshold)
+            self._stall_watchdog.start()
+
+    def load(self):
+        ''' Return the number of file descriptors we are monitoring '''
+        return max(0, len(self._registered) - 1)  # Exclude the waker
+
+    def edge_triggered(self):
+        ''' Return True if edge-triggered mode is enabled '''
+        return self._edge_triggered
+
+    def backend_name(self):
+        ''' Return the name of the backend in use '''
+        return self._backend.name
+
+    #
+    # In edge-triggered mode we are notified only when a file
+    # descriptor becomes ready, therefore handlers MUST read or
+    # write until the operation would block, otherwise they will
+    # never be notified again.  So we only use edge-triggered
+    # notifications for pollables that declare to be `edge_safe`
+    # (e.g. streams in drain mode) and level-triggered ones for
+    # the others.  Therefore, all the objects monitored by the
+    # poller must be subclasses of Pollable.  Only epoll supports it.
+    #
+    def _set_edge_triggered(self, enabled):
+        ''' Enable or disable edge-triggered mode '''
+        enabled = bool(enabled)
+        if enabled and self._backend.name != "epoll":
+            logging.warning("poller: edge-triggered mode needs epoll")
+            enabled = False
+        if enabled != self._edge_triggered:
+            self._edge_triggered = enabled
+            self._switch_backend(self._backend)
+
+    def _switch_backend(self, backend):
+        ''' Move all registrations to the specified backend '''
+        self._flush_interest()
+        registered, self._registered = self._registered, {}
+        for fileno in registered:
+            self._backend.unregister(fileno)
+        if backend is not self._backend:
+            self._backend.close()
+            self._backend = backend
+        for fileno in registered:
+            stream = self._readset.get(fileno, self._writeset.get(fileno))
+            self._update_interest(fileno, stream)
+
+    def call_soon(self, func, *args):
+        ''' Call func(*args) at the next iteration of the loop and
+            return a handle that allows to cancel the call '''
+        handle = Handle(func, args)
+        self._ready.append(handle)
+        return handle
+
+    def call_soon_threadsafe(self, func, *args):
+        ''' Like call_soon() but safe to call from any thread '''
+        handle = Handle(func, args)
+        self._ready.append(handle)
+        self._waker.wakeup()
+        return handle
+
+    def call_at(self, when, func, *args):
+        ''' Call func(*args) at the ticks() time when and return
+            a handle that allows to cancel the call '''
+        return self._timers.schedule(when, func, args)
+
+    def call_later(self, delay, func, *args):
+        ''' Call func(*args) after delay seconds and return a handle
+            that allows to cancel the call '''
+        return self._timers.schedule(ticks() + delay, func, args)
+
     def sched(self, delta, func, *args):
         ''' Schedule task '''
         #logging.debug('poller: sched: %s, %s, %s', delta, func, args)
-        self.enter(delta, 0, self._run_task, (func, args))
+        self.call_later(delta, self._run_task, func, args)
         return timestamp() + delta
 
     @staticmethod
@@ -79,28 +389,103 @@ class Poller(sched.scheduler):
 
     def set_readable(self, stream):
         ''' Monitor for readability '''
-        self._readset[stream.fileno()] = stream
+        fileno = stream.fileno()
+        self._readset[fileno] = stream
+        self._dirty[fileno] = stream
 
     def set_writable(self, stream):
         ''' Monitor for writability '''
-        self._writeset[stream.fileno()] = stream
+        fileno = stream.fileno()
+        self._writeset[fileno] = stream
+        self._dirty[fileno] = stream
 
     def unset_readable(self, stream):
         ''' Stop monitoring for readability '''
         fileno = stream.fileno()
         if fileno in self._readset:
             del self._readset[fileno]
+            self._dirty[fileno] = stream
 
     def unset_writable(self, stream):
         ''' Stop monitoring for writability '''
         fileno = stream.fileno()
         if fileno in self._writeset:
             del self._writeset[fileno]
+            self._dirty[fileno] = stream
 
-    def close(self, stream):
-        ''' Safely close a stream '''
+    #
+    # Since the kernel may forget about a file descriptor as soon
+    # as it is closed, and since a new socket may reuse its number,
+    # we MUST NOT defer the unregistration of a file descriptor that
+    # is about to be closed.  So, code that closes a socket without
+    # going through close() must call forget() before that.
+    #
+    def forget(self, stream):
+        ''' Immediately stop monitoring stream '''
+        fileno = stream.fileno()
         self.unset_readable(stream)
         self.unset_writable(stream)
+        for ready_io in self._ready_io:
+            if fileno in ready_io:
+                del ready_io[fileno]
+        if self._metrics is not None:
+            self._metrics.ready_since.pop(fileno, None)
+        if fileno in self._dirty:
+            del self._dirty[fileno]
+            self._update_interest(fileno, stream)
+
+    def _flush_interest(self):
+        ''' Tell the backend about the net interest changes '''
+        dirty, self._dirty = self._dirty, {}
+        for fileno, stream in dirty.items():
+            self._update_interest(fileno, stream)
+
+    #
+    # A stream is in the timing wheel as long as we monitor its
+    # file descriptor, which matches the old behavior of checking
+    # the watchdog of the streams in readset and writeset only.
+    #
+    # Because changes are deferred, the stream that owns a file
+    # descriptor may change without the file descriptor ever being
+    # unregistered, e.g. when the connector hands the socket over
+    # to a new stream, so we also keep track of the owner.
+    #
+    def _update_interest(self, fileno, stream):
+        ''' Tell the backend about interest changes for fileno '''
+        events = 0
+        if fileno in self._readset:
+            events |= poller_backend.READ
+            stream = self._readset[fileno]
+        if fileno in self._writeset:
+            events |= poller_backend.WRITE
+            stream = self._writeset[fileno]
+        if events and self._edge_triggered and stream.edge_safe:
+            events |= poller_backend.EDGE
+
+        current, owner = self._registered.get(fileno, (0, None))
+        if not events:
+            if current:
+                del self._registered[fileno]
+                self._backend.unregister(fileno)
+                self._wheel.remove(owner)
+            return
+
+        if owner is not stream:
+            if owner is not None:
+                self._wheel.remove(owner)
+            self._wheel.add(stream)
+        self._registered[fileno] = (events, stream)
+
+        if not current:
+            self._backend.register(fileno, events)
+        elif events != current:
+            self._backend.modify(fileno, events)
+
+    def close(self, stream):
+        ''' Safely close a stream '''
+        if self.tracer is not None:
+            self.tracer.record(tracer.CLOSE, stream.fileno(), 0, ticks())
+        self.forget(stream)
         try:
             stream.handle_close()
         except (KeyboardInterrupt, SystemExit):
@@ -112,12 +497,12 @@ class Poller(sched.scheduler):
     # We are very careful when accessing readset and writeset because
     # it's possible that the fileno makes reference to a stream that
     # does not exist anymore.  Consider the following example: There is
-    # a stream that is both readable and writable, and so its fileno
-    # is both in res[0] and res[1].  But, when we invoke the stream's
+    # a stream that is both readable and writable, and so the backend
+    # returns READ|WRITE for its fileno.  But, when we invoke the stream's
     # readable() callback there is a protocol violation and so the
     # high-level code invokes close(), and the stream is closed, and
     # hence removed from readset and writeset.  And then the stream
-    # does not exist anymore, but its fileno still is in res[1].
+    # does not exist anymore, but we still have to dispatch WRITE.
     #
 
     def _call_handle_read(self, fileno):
@@ -148,6 +533,74 @@ class Poller(sched.scheduler):
         ''' Break out of poller loop '''
         self._again = False
 
+    def run(self):
+        ''' Run timers and dispatch I/O events until break_loop() '''
+        # Always record the thread, since the stall watchdog may be
+        # started later on, e.g. by a callback or by another thread
+        self._loop_thread = threading.current_thread().ident
+        if self._stall_watchdog is not None:
+            self._busy_since = ticks()
+        while True:
+            self._run_timers()
+            self._run_ready()
+            if self._ready or any(self._ready_io):
+                self._poll(0)
+            else:
+                self._poll(self._timers.timeout(ticks()))
+
+    def _run_ready(self):
+        ''' Safely run the callbacks deferred using call_soon() '''
+        # Callbacks deferred by these callbacks run at the next iteration
+        ready = self._ready
+        measured = self._metrics is not None or self.tracer is not None
+        for _ in range(len(ready)):
+            handle = ready.popleft()
+            if handle.cancelled():
+                continue
+            if measured:
+                self._run_measured(handle, tracer.CALLBACK)
+                continue
+            try:
+                handle.run()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error('poller: deferred callback failed', exc_info=1)
+
+    def _run_timers(self):
+        ''' Safely run the expired timers '''
+        measured = self._metrics is not None or self.tracer is not None
+        for handle in self._timers.pop_expired(ticks()):
+            # A previous timer may have cancelled this one
+            if handle.cancelled():
+                continue
+            if measured:
+                self._run_measured(handle, tracer.TIMER)
+                continue
+            try:
+                handle.run()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error('poller: timer callback failed', exc_info=1)
+
+    def _run_measured(self, handle, kind):
+        ''' Safely run a timer or deferred callback and measure it '''
+        name = describe(handle._func, handle._args)
+        begin = ticks()
+        try:
+            handle.run()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            logging.error('poller: callback %s failed', name, exc_info=1)
+        elapsed = ticks() - begin
+        if self._metrics is not None:
+            self._metrics.callback(name, elapsed)
+        if self.tracer is not None:
+            self.tracer.record(kind, -1, self.tracer.intern(name), begin,
+                               elapsed)
+
     def loop(self):
         ''' Poller loop '''
         while True:
@@ -156,6 +609,7 @@ class Poller(sched.scheduler):
             except (SystemExit, select.error):
                 raise
             except KeyboardInterrupt:
+                self._busy_since = None
                 break  # overriden semantic: break out of poller loop NOW
             except:
                 logging.error('poller: unhandled exception', exc_info=1)
@@ -168,47 +622,148 @@ class Poller(sched.scheduler):
             raise KeyboardInterrupt('poller: self._again is false')
 
         # Monitor streams readability/writability
-        elif self._readset or self._writeset:
+        elif self._has_pending_io():
 
             # Get list of readable/writable streams
+            self._flush_interest()
+            metrics = self._metrics
+            if metrics is not None:
+                metrics.end_iteration(ticks())
+            watchdog = self._stall_watchdog
+            if watchdog is not None:
+                self._busy_since = None
+            if self.tracer is not None:
+                begin = ticks()
             try:
-                res = select.select(list(self._readset.keys()),
-                                    list(self._writeset.keys()),
-                                    [], timeout)
-            except select.error:
-                code = sys.exc_info()[1][0]
-                if code != errno.EINTR:
-                    logging.error('poller: select() failed', exc_info=1)
+                res = self._backend.poll(timeout)
+            except (select.error, IOError, OSError) as error:
+                if error.args[0] != errno.EINTR:
+                    logging.error('poller: %s() failed', self._backend.name,
+                                  exc_info=1)
                     raise
 
                 else:
                     # Take care of EINTR
                     return
-
-            # No error?  Fire readable and writable events
-            for fileno in res[0]:
-                self._call_handle_read(fileno)
-            for fileno in res[1]:
-                self._call_handle_write(fileno)
+            finally:
+                if watchdog is not None:
+                    self._busy_since = ticks()
+
+            # No error?  Queue and fire readable and writable events
+            if metrics is not None:
+                now = ticks()
+                metrics.begin_iteration(now, len(res))
+            if self.tracer is not None:
+                self.tracer.record(tracer.POLL, -1, len(res), begin,
+                                   ticks() - begin)
+            for fileno, events in res:
+                stream = self._readset.get(fileno)
+                if stream is None:
+                    stream = self._writeset.get(fileno)
+                    if stream is None:
+                        continue
+                ready_io = self._ready_io[stream.get_priority()]
+                ready_io[fileno] = ready_io.get(fileno, 0) | events
+                if metrics is not None:
+                    metrics.ready_since.setdefault(fileno, now)
+            self._dispatch_io()
+
+        # Deferred callbacks pending?  Run them at the next iteration.
+        elif self._ready:
+            return
 
         # No I/O pending?  Break out of the loop.
         else:
             raise KeyboardInterrupt('poller: no I/O pending')
 
+    def _has_pending_io(self):
+        ''' Return True if we are monitoring something else than the
+            internal waker or we are waiting for executor tasks '''
+        return (self._persistent or
+                len(self._readset) > 1 or bool(self._writeset) or
+                bool(self._thread_pool and self._thread_pool.pending()) or
+                bool(self._process_pool and self._process_pool.pending()))
+
+    def _dispatch_io(self):
+        ''' Dispatch ready file descriptors within the budget '''
+        budget_bytes = self._budget_bytes
+        budget_callbacks = self._budget_callbacks
+        self._spent_bytes = 0
+        callbacks = 0
+        exhausted = False
+        metrics = self._metrics
+
+        for priority, ready_io in enumerate(self._ready_io):
+            timed = (priority == PRIORITY_LOW and self._low_priority_slice)
+            spent_time = 0.0
+
+            while ready_io and not exhausted:
+                if budget_callbacks and callbacks >= budget_callbacks:
+                    self._stats["budget_callbacks_hit"] += 1
+                    exhausted = True
+                    break
+                if budget_bytes and self._spent_bytes >= budget_bytes:
+                    self._stats["budget_bytes_hit"] += 1
+                    exhausted = True
+                    break
+                if timed and spent_time >= self._low_priority_slice:
+                    self._stats["low_priority_capped"] += 1
+                    break
+                if timed:
+                    begin = ticks()
+                fileno, events = ready_io.popitem(last=False)
+                if metrics is not None:
+                    callbacks += self._dispatch_measured(fileno, events,
+                                                         metrics)
+                else:
+                    if events & poller_backend.READ:
+                        self._call_handle_read(fileno)
+                        callbacks += 1
+                    if events & poller_backend.WRITE:
+                        self._call_handle_write(fileno)
+                        callbacks += 1
+                if timed:
+                    spent_time += ticks() - begin
+
+            self._stats["carried_over"] += len(ready_io)
+
+    def _dispatch_measured(self, fileno, events, metrics):
+        ''' Dispatch the events of fileno and measure the callbacks '''
+        begin = ticks()
+        metrics.dispatched(fileno, begin)
+        callbacks = 0
+        if events & poller_backend.READ:
+            stream = self._readset.get(fileno)
+            self._call_handle_read(fileno)
+            callbacks += 1
+            if stream is not None:
+                end = ticks()
+                metrics.callback(stream.__class__.__name__ + ".handle_read",
+                                 end - begin)
+                begin = end
+        if events & poller_backend.WRITE:
+            stream = self._writeset.get(fileno)
+            self._call_handle_write(fileno)
+            callbacks += 1
+            if stream is not None:
+                metrics.callback(stream.__class__.__name__ + ".handle_write",
+                                 ticks() - begin)
+        return callbacks
+
     def _check_timeout(self):
         ''' Dispatch the periodic event '''
 
-        self.sched(CHECK_TIMEOUT, self._check_timeout)
-        if self._readset or self._writeset:
+        self.call_later(CHECK_TIMEOUT, self._check_timeout)
 
-            streams = set()
-            streams.update(list(self._readset.values()))
-            streams.update(list(self._writeset.values()))
-
-            timenow = ticks()
-            for stream in streams:
-                if stream.handle_periodic(timenow):
-                    logging.debug('poller: watchdog timeout: %s', str(stream))
-                    self.close(stream)
+        timenow = ticks()
+        for stream in self._wheel.expire(timenow):
+            # Closing a stream may have closed also this one
+            if stream._wheel is not self._wheel:
+                continue
+            if stream.handle_periodic(timenow):
+                logging.debug('poller: watchdog timeout: %s', str(stream))
+                self.close(stream)
+            else:
+                self._wheel.rearm(stream)
 
 POLLER = Poller()
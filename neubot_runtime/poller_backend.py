@@ -0,0 +1,273 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' I/O multiplexing backends used by the poller '''
+
+#
+# Each backend keeps a persistent registration for every file
+# descriptor, so that the poller only pays when the interest in
+# a file descriptor changes, and not at every loop iteration.
+#
+# All backends share the same interface:
+#
+#     register(fileno, events)
+#     modify(fileno, events)
+#     unregister(fileno)
+#     poll(timeout) -> [(fileno, events), ...]
+#     close()
+#
+# where `events` is a bitmask of READ, WRITE and (only for the
+# registration) EDGE.  The timeout is in seconds, and None means
+# block until something happens.  Error and hangup conditions are
+# reported as READ|WRITE, which is what select() does and which
+# causes the stream code to notice the error on the next recv()
+# or send() operation.
+#
+
+import errno
+import logging
+import math
+import select
+
+# Events
+READ = 1 << 0
+WRITE = 1 << 1
+
+# Registration flag: request edge-triggered notification
+EDGE = 1 << 2
+
+# Errors meaning that the kernel already forgot about the fd
+GONE_ERRORS = (errno.EBADF, errno.ENOENT)
+
+class SelectBackend(object):
+    ''' Backend using select(), limited to FD_SETSIZE descriptors '''
+
+    name = 'select'
+
+    def __init__(self):
+        self._readfds = set()
+        self._writefds = set()
+
+    def register(self, fileno, events):
+        ''' Start monitoring fileno '''
+        self.modify(fileno, events)
+
+    def modify(self, fileno, events):
+        ''' Change the events we are interested to '''
+        if events & READ:
+            self._readfds.add(fileno)
+        else:
+            self._readfds.discard(fileno)
+        if events & WRITE:
+            self._writefds.add(fileno)
+        else:
+            self._writefds.discard(fileno)
+
+    def unregister(self, fileno):
+        ''' Stop monitoring fileno '''
+        self._readfds.discard(fileno)
+        self._writefds.discard(fileno)
+
+    def poll(self, timeout):
+        ''' Wait for I/O events '''
+        result = []
+        if not self._readfds and not self._writefds:
+            return result
+        readable, writable, _ = select.select(list(self._readfds),
+                                              list(self._writefds),
+                                              [], timeout)
+        writable = set(writable)
+        for fileno in readable:
+            if fileno in writable:
+                writable.remove(fileno)
+                result.append((fileno, READ|WRITE))
+            else:
+                result.append((fileno, READ))
+        for fileno in writable:
+            result.append((fileno, WRITE))
+        return result
+
+    def close(self):
+        ''' Release resources '''
+        self._readfds.clear()
+        self._writefds.clear()
+
+class PollBackend(object):
+    ''' Backend using poll() '''
+
+    name = 'poll'
+
+    def __init__(self):
+        self._poll = select.poll()
+        self._errmask = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+    @staticmethod
+    def _mask(events):
+        ''' Map our events to poll() events '''
+        mask = 0
+        if events & READ:
+            mask |= select.POLLIN | select.POLLPRI
+        if events & WRITE:
+            mask |= select.POLLOUT
+        return mask
+
+    def register(self, fileno, events):
+        ''' Start monitoring fileno '''
+        self._poll.register(fileno, self._mask(events))
+
+    def modify(self, fileno, events):
+        ''' Change the events we are interested to '''
+        try:
+            self._poll.modify(fileno, self._mask(events))
+        except (IOError, OSError) as error:
+            if error.args[0] != errno.ENOENT:
+                raise
+            self._poll.register(fileno, self._mask(events))
+
+    def unregister(self, fileno):
+        ''' Stop monitoring fileno '''
+        try:
+            self._poll.unregister(fileno)
+        except KeyError:
+            pass
+
+    def poll(self, timeout):
+        ''' Wait for I/O events '''
+        if timeout is not None:
+            timeout = int(math.ceil(timeout * 1000))
+        result = []
+        for fileno, mask in self._poll.poll(timeout):
+            events = 0
+            if mask & (select.POLLIN | select.POLLPRI):
+                events |= READ
+            if mask & select.POLLOUT:
+                events |= WRITE
+            if mask & self._errmask:
+                events |= READ|WRITE
+            result.append((fileno, events))
+        return result
+
+    def close(self):
+        ''' Release resources '''
+        self._poll = None
+
+class EpollBackend(object):
+    ''' Backend using Linux epoll(), optionally edge-triggered '''
+
+    name = 'epoll'
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        self._errmask = select.EPOLLERR | select.EPOLLHUP
+
+    @staticmethod
+    def _mask(events):
+        ''' Map our events to epoll() events '''
+        mask = 0
+        if events & READ:
+            mask |= select.EPOLLIN | select.EPOLLPRI
+        if events & WRITE:
+            mask |= select.EPOLLOUT
+        if events & EDGE:
+            mask |= select.EPOLLET
+        return mask
+
+    def register(self, fileno, events):
+        ''' Start monitoring fileno '''
+        try:
+            self._epoll.register(fileno, self._mask(events))
+        except (IOError, OSError) as error:
+            if error.args[0] != errno.EEXIST:
+                raise
+            self._epoll.modify(fileno, self._mask(events))
+
+    #
+    # The kernel automatically removes a file descriptor from the
+    # epoll set when it is closed, therefore a modify() may fail
+    # because the file descriptor number was reused by a new socket
+    # that we have never registered.
+    #
+    def modify(self, fileno, events):
+        ''' Change the events we are interested to '''
+        try:
+            self._epoll.modify(fileno, self._mask(events))
+        except (IOError, OSError) as error:
+            if error.args[0] != errno.ENOENT:
+                raise
+            self._epoll.register(fileno, self._mask(events))
+
+    def unregister(self, fileno):
+        ''' Stop monitoring fileno '''
+        try:
+            self._epoll.unregister(fileno)
+        except (IOError, OSError) as error:
+            if error.args[0] not in GONE_ERRORS:
+                raise
+        except ValueError:
+            pass  # negative or otherwise invalid fileno
+
+    def poll(self, timeout):
+        ''' Wait for I/O events '''
+        if timeout is None:
+            timeout = -1
+        result = []
+        for fileno, mask in self._epoll.poll(timeout):
+            events = 0
+            if mask & (select.EPOLLIN | select.EPOLLPRI):
+                events |= READ
+            if mask & select.EPOLLOUT:
+                events |= WRITE
+            if mask & self._errmask:
+                events |= READ|WRITE
+            result.append((fileno, events))
+        return result
+
+    def close(self):
+        ''' Release resources '''
+        self._epoll.close()
+
+BACKENDS = {
+    'epoll': EpollBackend,
+    'poll': PollBackend,
+    'select': SelectBackend,
+}
+
+def available():
+    ''' Return the backends available here, best one first '''
+    result = []
+    if hasattr(select, 'epoll'):
+        result.append('epoll')
+    if hasattr(select, 'poll'):
+        result.append('poll')
+    result.append('select')
+    return result
+
+def create(name=None):
+    ''' Create backend by name, or the best available one '''
+    supported = available()
+    if name and name != 'auto':
+        if name not in BACKENDS:
+            raise ValueError('poller_backend: unknown backend: %s' % name)
+        if name in supported:
+            return BACKENDS[name]()
+        logging.warning('poller_backend: %s not available, using %s',
+                        name, supported[0])
+    return BACKENDS[supported[0]]()
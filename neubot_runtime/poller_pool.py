@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' One poller per thread, with connections sharded among them '''
+
+#
+# A PollerPool runs N persistent pollers, each on its own thread, and
+# each poller (shard) owns a disjoint set of streams.  A ShardedHandler
+# listens using a poller (typically the one of the main thread) and
+# hands every accepted socket to the least loaded shard, where it is
+# delivered to a per-shard handler created by a factory:
+#
+#     pool = PollerPool(4)
+#     handler = ShardedHandler(POLLER, pool, HttpServer)
+#     handler.configure(conf)
+#     handler.listen(("", 8080))
+#     pool.start()
+#     POLLER.loop()
+#
+# Streams never migrate between shards, so the code running inside a
+# shard is single threaded, as usual.  On free-threaded (no-GIL) builds
+# of Python the shards perform I/O in parallel; with the GIL they still
+# keep a slow handler from stalling the streams of the other shards.
+#
+
+import logging
+import threading
+
+from .poller import Poller
+from .stream_handler import StreamHandler
+
+class PollerPool(object):
+    ''' Run N pollers, each on its own thread '''
+
+    def __init__(self, count, conf=None):
+        self.pollers = []
+        for _ in range(count):
+            poller = Poller(persistent=True)
+            if conf:
+                poller.configure(conf)
+            self.pollers.append(poller)
+        self._threads = []
+
+    def start(self):
+        ''' Start the threads running the pollers '''
+        for index, poller in enumerate(self.pollers):
+            thread = threading.Thread(target=poller.loop,
+                                      name="poller-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        ''' Break the loops and wait for the threads '''
+        for poller in self.pollers:
+            poller.call_soon_threadsafe(poller.break_loop)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+class ShardedHandler(StreamHandler):
+    ''' Hand accepted sockets to the least loaded shard '''
+
+    #
+    # The load of a shard is the number of file descriptors monitored
+    # by its poller, plus the sockets we handed to the shard that it
+    # did not process yet.  Each of the two counters used to compute
+    # the latter is only written by a single thread.
+    #
+
+    def __init__(self, poller, pool, factory):
+        StreamHandler.__init__(self, poller)
+        self._pool = pool
+        self.handlers = [factory(shard) for shard in pool.pollers]
+        self._handed = [0] * len(pool.pollers)
+        self._delivered = [0] * len(pool.pollers)
+
+    def configure(self, conf):
+        StreamHandler.configure(self, conf)
+        for handler in self.handlers:
+            handler.configure(conf)
+
+    def _least_loaded(self):
+        ''' Return the index of the least loaded shard '''
+        best, best_load = 0, None
+        for index, shard in enumerate(self._pool.pollers):
+            load = (shard.load() + self._handed[index] -
+                    self._delivered[index])
+            if best_load is None or load < best_load:
+                best, best_load = index, load
+        return best
+
+    def connection_made(self, sock, endpoint, rtt):
+        index = self._least_loaded()
+        self._handed[index] += 1
+        self._pool.pollers[index].call_soon_threadsafe(
+            self._deliver, index, sock, endpoint, rtt)
+
+    def _deliver(self, index, sock, endpoint, rtt):
+        ''' Deliver the accepted socket in the shard thread '''
+        self._delivered[index] += 1
+        self.handlers[index].connection_made(sock, endpoint, rtt)
+
+    def bind_failed(self, epnt):
+        self.handlers[0].bind_failed(epnt)
+
+    def started_listening(self, listener):
+        logging.debug("sharded handler: listening with %d shards",
+                      len(self.handlers))
+        self.handlers[0].started_listening(listener)
+
+    def accept_failed(self, listener, exception):
+        self.handlers[0].accept_failed(listener, exception)
@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Prefork multi-process server mode '''
+
+#
+# The supervisor forks N workers and restarts them when they die.  Each
+# worker runs `worker_main(index)`, which typically configures a server
+# with `net.listen.reuseport` set, listens, and runs the poller loop:
+#
+#     def worker_main(index):
+#         HTTP_SERVER.configure({"net.listen.reuseport": True})
+#         HTTP_SERVER.listen(("", 8080))
+#         POLLER.loop()
+#
+#     Supervisor(worker_main, workers=16, affinity=True).run()
+#
+# Since every worker has its own listening sockets bound with the
+# SO_REUSEPORT option, the kernel load balances accepts among them,
+# and throughput scales with the number of cores.
+#
+# We call POLLER.after_fork() in each worker, so that the module-level
+# singletons (POLLER and HTTP_SERVER) are safe to use there.  Workers
+# using other pollers created before fork() must call after_fork() on
+# them.  The supervisor SHOULD NOT run the loop of the poller, or listen,
+# before forking.
+#
+
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from .poller import POLLER
+
+# Do not restart workers more often than once every RESTART_DELAY seconds
+RESTART_DELAY = 1.0
+
+class Supervisor(object):
+    ''' Fork and supervise worker processes '''
+
+    def __init__(self, worker_main, workers=0, affinity=False):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("prefork: fork() not available")
+        if workers <= 0:
+            workers = len(_available_cpus())
+        self._worker_main = worker_main
+        self._workers = workers
+        self._affinity = affinity
+        self._children = {}
+        self._started = {}
+        self._again = True
+
+    def run(self):
+        ''' Start the workers and supervise them until stop() '''
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+        for index in range(self._workers):
+            self._spawn(index)
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except OSError as error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            index = self._children.pop(pid, None)
+            if index is None:
+                continue
+            if not self._again:
+                continue
+            logging.warning("prefork: worker %d (pid %d) died: status %d",
+                            index, pid, status)
+            elapsed = time.time() - self._started[index]
+            if elapsed < RESTART_DELAY:
+                time.sleep(RESTART_DELAY - elapsed)
+                # We may have been stopped while sleeping
+                if not self._again:
+                    continue
+            self._spawn(index)
+
+    def stop(self):
+        ''' Stop the workers and then return from run() '''
+        self._again = False
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _on_signal(self, signo, frame):
+        ''' Stop on SIGTERM and SIGINT '''
+        logging.info("prefork: got signal %d; stopping workers", signo)
+        self.stop()
+
+    def _spawn(self, index):
+        ''' Fork the index-th worker '''
+        self._started[index] = time.time()
+        pid = os.fork()
+        if pid > 0:
+            logging.debug("prefork: worker %d has pid %d", index, pid)
+            self._children[pid] = index
+            if not self._again:
+                # stop() ran before we registered this worker
+                os.kill(pid, signal.SIGTERM)
+            return
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        status = 0
+        try:
+            POLLER.after_fork()
+            if self._affinity and hasattr(os, "sched_setaffinity"):
+                cpus = _available_cpus()
+                os.sched_setaffinity(0, [cpus[index % len(cpus)]])
+            self._worker_main(index)
+        except SystemExit as exception:
+            status = exception.code if isinstance(exception.code, int) else 1
+        except:
+            logging.error("prefork: worker %d failed", index, exc_info=1)
+            status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+def _available_cpus():
+    ''' Return the sorted list of CPUs we can run on '''
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Detect and report stalls of the poller loop '''
+
+#
+# A blocking call in a handler (e.g. getaddrinfo() in utils_net.connect()
+# or reading a file in Stream.read_send_queue()) freezes the loop for all
+# the streams, yet it does not show up in the logs.
+#
+# When the stall watchdog is enabled (see `poller.stall_threshold`), the
+# poller records when it stopped waiting in the backend, and clears that
+# timestamp before waiting again.  A thread samples the timestamp and,
+# when the loop has been busy for longer than the threshold, it grabs
+# the stack of the thread running the loop using sys._current_frames().
+# The first sample of each stall is logged with the full stack, and the
+# innermost frames of all samples are counted, so that report() returns
+# the top offenders and how often we caught the loop running them.
+#
+
+import collections
+import logging
+import sys
+import threading
+import traceback
+
+from .utils import ticks
+
+# Default stall threshold in seconds
+STALL_THRESHOLD = 0.1
+
+class StallWatchdog(object):
+    ''' Thread that reports when the poller loop blocks '''
+
+    def __init__(self, poller, threshold=STALL_THRESHOLD):
+        self._poller = poller
+        self.threshold = threshold
+        self.stalls = 0
+        self.offenders = collections.Counter()
+        self._last_stall = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ''' Start the sampling thread '''
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="stall-watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        ''' Stop the sampling thread '''
+        if self._thread is None:
+            return
+        self._stopped.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def report(self, count=10):
+        ''' Return the count most frequent (frame, samples) pairs '''
+        return self.offenders.most_common(count)
+
+    def _run(self):
+        ''' Sample the poller loop until stopped '''
+        # Sample a few times per threshold to see what a stall is doing
+        interval = self.threshold / 4
+        while not self._stopped.wait(interval):
+            try:
+                self._sample()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error("stall_watchdog: sampling failed", exc_info=1)
+
+    def _sample(self):
+        ''' Check whether the loop is stalled and where '''
+        since, ident = self._poller._busy_since, self._poller._loop_thread
+        if since is None or ident is None:
+            return
+        elapsed = ticks() - since
+        if elapsed < self.threshold:
+            return
+        frame = sys._current_frames().get(ident)
+        if frame is None:
+            return
+        code = frame.f_code
+        self.offenders["%s:%d (%s)" % (code.co_filename, frame.f_lineno,
+                                       code.co_name)] += 1
+        if since != self._last_stall:
+            self._last_stall = since
+            self.stalls += 1
+            logging.warning("stall_watchdog: loop blocked for %.3f s in:\n%s",
+                            elapsed, "".join(traceback.format_stack(frame)))
@@ -22,7 +22,10 @@
 """ Stream abstraction """
 
 import collections
+import io
 import logging
+import os
+import stat
 
 from .pollable import Pollable
 from .pollable import SUCCESS
@@ -30,6 +33,10 @@ from .pollable import WANT_READ
 from .pollable import WANT_WRITE
 from .pollable import CONNRST
 from .async_socket import AsyncSocket
+from .buffer_pool import BUFFER_POOL
+from .tracer import READ
+from .tracer import WRITE
+from .utils import ticks
 
 from .third_party import six
 
@@ -38,6 +45,96 @@ from . import utils_net
 # Maximum amount of bytes we read from a socket
 MAXBUF = 1 << 18
 
+# Maximum amount of bytes moved per event in drain mode
+DRAIN_BUDGET = 1 << 20
+
+# Queued bytes above which we ask the upper layer to pause writing
+HIGH_WATERMARK = 1 << 20
+
+# Queued bytes below which we ask the upper layer to resume writing
+LOW_WATERMARK = 1 << 18
+
+# Maximum number of buffers we pass to sendmsg()
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+# Maximum amount of bytes we pass to sendmsg()
+GATHER_MAX = 1 << 20
+
+# Queued objects that we can pass to sendmsg()
+GATHERABLE = (bytes, bytearray, memoryview)
+
+# Maximum amount of bytes we pass to sendfile()
+SENDFILE_MAX = 1 << 20
+
+# Seconds between checks for completed zero-copy sends
+ZEROCOPY_REAP = 0.05
+
+class FileRange(object):
+    """ Part of a regular file that we send using sendfile() """
+
+    def __init__(self, fileobj, fileno, offset, end):
+        self.fileobj = fileobj
+        self.fileno = fileno
+        self.offset = offset
+        self.end = end
+
+    def __len__(self):
+        return max(0, self.end - self.offset)
+
+    def advance(self, count):
+        """ Skip count bytes and, when done, update the file position """
+        self.offset += count
+        if self.offset >= self.end:
+            self.fileobj.seek(self.offset)
+
+#
+# We may bypass read() and write() and use the file descriptor of a file
+# object directly only when they read and write the bytes of the file as
+# they are.  This is not the case of wrappers like GzipFile, BZ2File or
+# LZMAFile, whose fileno() is the compressed file, or of text files,
+# hence we only accept the exact types below and we never use isinstance.
+#
+PLAIN_FILES = (io.FileIO, io.BufferedReader, io.BufferedWriter,
+               io.BufferedRandom)
+
+try:
+    _PY2_FILE = file
+except NameError:
+    _PY2_FILE = None
+
+def regular_fileno(fileobj):
+    """ Return the file descriptor of fileobj if it is a plain file
+        object (see above) opened on a regular file, or -1 """
+    kind = type(fileobj)
+    if kind not in PLAIN_FILES and not (
+            kind is _PY2_FILE and "b" in fileobj.mode):
+        return -1
+    try:
+        fileno = fileobj.fileno()
+        if not stat.S_ISREG(os.fstat(fileno).st_mode):
+            return -1
+    except (IOError, OSError, ValueError):
+        return -1
+    return fileno
+
+def _file_range(fileobj):
+    """ Return the FileRange from the current position of fileobj to
+        its end, or None if fileobj is not a plain regular file """
+    fileno = regular_fileno(fileobj)
+    if fileno < 0:
+        return None
+    try:
+        offset = fileobj.tell()
+        size = os.fstat(fileno).st_size
+    except (IOError, OSError, ValueError):
+        return None
+    return FileRange(fileobj, fileno, offset, size)
+
 class Stream(Pollable):
     """ Stream class """
 
@@ -58,9 +155,27 @@ class Stream(Pollable):
         self.close_complete = False
         self.close_pending = False
         self.recv_pending = False
+        self.reading_paused = False
+        self.recv_memoryview = False
+        self.drain = False
+        self.drain_budget = DRAIN_BUDGET
+        self._read_maybe_ready = False
+        self.gather = False
+        self.sendfile = False
+        self.zerocopy_threshold = 0
+        self._zc_next = 0
+        self._zc_pinned = {}
+        self._zc_refs = {}
+        self._zc_timer = None
+        self.optimistic_send = True
+        self._flush_scheduled = False
         self.send_octets = None
         self.send_queue = collections.deque()
         self.send_pending = False
+        self.send_queued = 0
+        self.high_watermark = HIGH_WATERMARK
+        self.low_watermark = LOW_WATERMARK
+        self.writing_paused = False
 
         self.bytes_recv_tot = 0
         self.bytes_sent_tot = 0
@@ -85,15 +200,63 @@ class Stream(Pollable):
         self.peername = utils_net.getpeername(sock)
         self.logname = str((self.myname, self.peername))
 
+        if conf and "net.stream.recv_memoryview" in conf:
+            self.recv_memoryview = bool(conf["net.stream.recv_memoryview"])
+        if conf and conf.get("net.stream.drain", False):
+            self.set_drain(True, int(conf.get("net.stream.drain_budget",
+                                              DRAIN_BUDGET)))
+
         logging.debug("* Connection made %s", str(self.logname))
 
         self.sock = AsyncSocket(sock)
+        self.gather = self.sock.can_sendmsg() and bool(
+            (conf or {}).get("net.stream.gather", True))
+        self.sendfile = self.sock.can_sendfile() and bool(
+            (conf or {}).get("net.stream.sendfile", True))
+        threshold = int((conf or {}).get("net.stream.zerocopy_threshold", 0))
+        if threshold > 0 and self.sock.enable_zerocopy():
+            self.zerocopy_threshold = threshold
+        self.optimistic_send = bool((conf or {}).get(
+            "net.stream.optimistic_send", True))
+        if conf and "net.stream.high_watermark" in conf:
+            self.set_watermarks(int(conf["net.stream.high_watermark"]),
+                                conf.get("net.stream.low_watermark"))
 
         self.connection_made()
 
     def connection_made(self):
         """ Called when the connection is made """
 
+    #
+    # In drain mode a readable event reads until the socket would
+    # block, delivering each chunk to recv_complete() as long as the
+    # upper layer calls start_recv() again, and a writable event sends
+    # until the socket would block or the queue is empty.  At most
+    # drain_budget bytes are moved per event, after which we continue
+    # at the next iteration of the loop, so that a fast stream cannot
+    # monopolize the loop.
+    #
+    # Since we may stop before the socket would block, we remember
+    # that more data may be ready and, when the upper layer wants more
+    # data, we read it without waiting for the poller.  Likewise, we
+    # try to send as soon as a send operation starts.  This makes the
+    # stream safe to use with an edge-triggered poller, which does not
+    # notify us again about data that was ready before.
+    #
+
+    def set_drain(self, enabled, budget=DRAIN_BUDGET):
+        """ Enable or disable drain mode """
+        self.drain = bool(enabled)
+        self.drain_budget = budget
+        if self.edge_safe != self.drain:
+            self.edge_safe = self.drain
+            # Let the poller register the socket again, with or without
+            # edge-triggered notifications
+            if self.recv_pending and not self.reading_paused:
+                self.poller.set_readable(self)
+            if self.send_pending:
+                self.poller.set_writable(self)
+
     def atclose(self, func):
         """ Register function to be called at close """
         if func in self.atclosev:
@@ -136,7 +299,9 @@ class Stream(Pollable):
                 logging.error("Error in atclosev", exc_info=1)
 
         self.send_octets = None
+        self.send_queued = 0
         self.sock.soclose()
+        self._zerocopy_release()
 
     # Recv path
 
@@ -147,32 +312,138 @@ class Stream(Pollable):
             return
 
         self.recv_pending = True
+        if self.reading_paused:
+            return
         self.poller.set_readable(self)
+        if self._read_maybe_ready:
+            self.poller.call_soon(self._drain_read)
+
+    #
+    # The upper layer may call pause_reading() to stop receiving, e.g.
+    # because it cannot keep up with the data, and resume_reading() to
+    # start again.  While reading is paused start_recv() only records that
+    # the upper layer wants more data, and we do not monitor the socket
+    # for readability, so the peer eventually blocks on a full window.
+    #
+
+    def pause_reading(self):
+        """ Stop receiving until resume_reading() is called """
+        if self.reading_paused:
+            return
+        self.reading_paused = True
+        if self.recv_pending and not self.close_complete:
+            self.poller.unset_readable(self)
+
+    def resume_reading(self):
+        """ Receive again after pause_reading() """
+        if not self.reading_paused:
+            return
+        self.reading_paused = False
+        if self.recv_pending and not self.close_complete:
+            self.poller.set_readable(self)
+            if self._read_maybe_ready:
+                self.poller.call_soon(self._drain_read)
+
+    def _drain_read(self):
+        """ Read data that may be ready without waiting for the poller """
+        if (self.recv_pending and self._read_maybe_ready and
+                not self.reading_paused and not self.close_complete):
+            try:
+                self.handle_read()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error("stream: handle_read() failed", exc_info=1)
+                self.poller.close(self)
+
+    #
+    # We receive into a buffer taken from the pool, and then we pass
+    # recv_complete() a copy of exactly the received bytes, so that we
+    # do not allocate a MAXBUF-sized object for every read.  Streams
+    # that set recv_memoryview (or net.stream.recv_memoryview) receive a
+    # memoryview of the buffer instead, which saves the copy but is only
+    # valid until recv_complete() returns: after that we reuse the buffer
+    # and, where supported, we release the memoryview.
+    #
 
     def handle_read(self):
-        status, octets = self.sock.sorecv(MAXBUF)
+        if self._zc_pinned:
+            self._zerocopy_reap()
+
+        if self.reading_paused:
+            # Paused after the poller collected the event: in drain mode
+            # the socket may be edge-triggered, so read it on resume
+            if self.drain:
+                self._read_maybe_ready = True
+            return
+
+        self._read_maybe_ready = False
+        if not self.drain:
+            self._read_once()
+            return
 
-        if status == SUCCESS and octets:
+        budget = self.drain_budget
+        while True:
+            count = self._read_once()
+            if count <= 0:
+                return
+            # A short read drained the socket, so the next recv() would
+            # fail with EAGAIN.  But with edge-triggered notifications we
+            # must see EAGAIN, or we could miss an EOF that arrived along
+            # with the data, because there would be no new edge for it.
+            if count < MAXBUF and not self.poller.edge_triggered():
+                return
+            if not self.recv_pending or self.reading_paused:
+                self._read_maybe_ready = True
+                return
+            budget -= count
+            if budget <= 0:
+                self._read_maybe_ready = True
+                self.poller.call_soon(self._drain_read)
+                return
+
+    def _read_once(self):
+        """ Receive once and return the number of bytes received """
+        buff = BUFFER_POOL.acquire()
+        status, count = self.sock.sorecv_into(buff, MAXBUF)
 
-            self.bytes_recv_tot += len(octets)
+        if status == SUCCESS and count:
+
+            self.bytes_recv_tot += count
+            self.poller.charge(count)
+            if self.poller.tracer is not None:
+                self.poller.tracer.record(READ, self.filenum, count, ticks())
             self.recv_pending = False
             self.poller.unset_readable(self)
 
-            self.recv_complete(octets)
-            return
+            view = memoryview(buff)[:count]
+            if not self.recv_memoryview:
+                octets = view.tobytes()
+                BUFFER_POOL.release(buff)
+                self.recv_complete(octets)
+                return count
+
+            try:
+                self.recv_complete(view)
+            finally:
+                if _release_view(view):
+                    BUFFER_POOL.release(buff)
+            return count
+
+        BUFFER_POOL.release(buff)
 
         if status == WANT_READ:
-            return
+            return 0
 
-        if status == CONNRST and not octets:
+        if status == CONNRST and not count:
             self.rst = True
             self.poller.close(self)
-            return
+            return 0
 
-        if status == SUCCESS and not octets:
+        if status == SUCCESS and not count:
             self.eof = True
             self.poller.close(self)
-            return
+            return 0
 
         raise RuntimeError("Unexpected status value")
 
@@ -193,16 +464,27 @@ class Stream(Pollable):
                 if octets:
                     break
             else:
+                if self.sendfile:
+                    piece = _file_range(octets)
+                    if piece is not None:
+                        self.send_queue.popleft()
+                        octets = piece
+                        if octets:
+                            break
+                        continue
                 octets = octets.read(MAXBUF)
                 if octets:
+                    self.send_queued += len(octets)
                     break
                 # remove the file-like when it is empty
                 self.send_queue.popleft()
 
-        if octets:
+        if octets and octets.__class__ is not FileRange:
             if octets.__class__ == six.u("").__class__:
                 logging.warning("Received unicode input")
+                length = len(octets)
                 octets = octets.encode("utf-8")
+                self.send_queued += len(octets) - length
 
         return octets
 
@@ -212,55 +494,276 @@ class Stream(Pollable):
             return
 
         self.send_queue.append(octets)
-        if self.send_pending:
+        if not hasattr(octets, "read"):
+            self.send_queued += len(octets)
+
+        if not self.send_pending:
+            self.send_octets = self.read_send_queue()
+            if self.send_octets:
+                self.send_pending = True
+                if self.optimistic_send:
+                    self._schedule_flush()
+                else:
+                    self.poller.set_writable(self)
+                    if self.drain:
+                        self.poller.call_soon(self._drain_write)
+
+        if (not self.writing_paused and self.high_watermark > 0 and
+                self.send_queued > self.high_watermark and
+                not self.close_complete):
+            self.writing_paused = True
+            self.pause_writing()
+
+    #
+    # We keep track of the bytes that were queued with start_send() and
+    # are not sent yet (send_queued), including the data that we read
+    # from file-like objects, which we read lazily and therefore do not
+    # count until we read them.  When send_queued grows above the high
+    # watermark we invoke pause_writing(), and when it drops back to the
+    # low watermark we invoke resume_writing(), so that a producer faster
+    # than the network can stop queueing data instead of growing the
+    # memory used by the stream without bounds.  Since we notice that in
+    # the middle of a send, resume_writing() is invoked at the next
+    # iteration of the loop.  A high watermark of zero disables this
+    # mechanism.  The watermarks may be set with the
+    # net.stream.high_watermark and net.stream.low_watermark settings.
+    #
+
+    def set_watermarks(self, high=HIGH_WATERMARK, low=None):
+        """ Set the high and low watermarks of the send queue """
+        if low is None:
+            low = high // 4
+        low = int(low)
+        if high < 0 or low < 0 or (high > 0 and low > high):
+            raise ValueError("Invalid watermarks")
+        self.high_watermark = high
+        self.low_watermark = low
+
+    def pause_writing(self):
+        """ Called when the send queue grows above the high watermark """
+
+    def resume_writing(self):
+        """ Called when the send queue drops to the low watermark """
+
+    def _sent(self, count):
+        """ Account for count bytes sent from memory """
+        was_above = self.send_queued > self.low_watermark
+        self.send_queued -= count
+        if self.send_queued < 0:
+            self.send_queued = 0
+        if (self.writing_paused and was_above and
+                self.send_queued <= self.low_watermark):
+            # Do not reenter the upper layer while we are sending
+            self.poller.call_soon(self._deferred_resume_writing)
+
+    def _deferred_resume_writing(self):
+        """ Invoke resume_writing() if still needed """
+        if (self.writing_paused and not self.close_complete and
+                self.send_queued <= self.low_watermark):
+            self.writing_paused = False
+            self.resume_writing()
+
+    #
+    # The socket is almost always writable when a send starts, so by
+    # default (see net.stream.optimistic_send) we do not wait for the
+    # poller to tell us, which saves a poll and an interest update for
+    # each response: we send at the next iteration of the loop, before
+    # polling, and we register for writability only when the send is
+    # partial or would block.  We do not send directly in start_send(),
+    # because the upper layer usually queues the pieces of a message
+    # with consecutive calls, e.g. headers and then body, and we want
+    # them to go out together with a single sendmsg().  This also means
+    # that we never reenter the upper layer from start_send().
+    #
+
+    def _schedule_flush(self):
+        """ Send what was queued at the next iteration of the loop """
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.poller.call_soon(self._flush)
+
+    def _flush(self):
+        """ Send without waiting for the poller """
+        self._flush_scheduled = False
+        if not self.send_pending or self.close_complete:
             return
-
-        self.send_octets = self.read_send_queue()
-        if not self.send_octets:
+        try:
+            self.handle_write()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            logging.error("stream: handle_write() failed", exc_info=1)
+            self.poller.close(self)
             return
+        if self.send_pending and not self.close_complete:
+            self.poller.set_writable(self)
 
-        self.send_pending = True
-        self.poller.set_writable(self)
+    def _drain_write(self):
+        """ Send without waiting for the poller """
+        if self.send_pending and not self.close_complete:
+            try:
+                self.handle_write()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error("stream: handle_write() failed", exc_info=1)
+                self.poller.close(self)
 
     def handle_write(self):
-        status, count = self.sock.sosend(self.send_octets)
+        if self._zc_pinned:
+            self._zerocopy_reap()
 
-        if status == SUCCESS and count > 0:
-            self.bytes_sent_tot += count
-
-            if count == len(self.send_octets):
-
-                self.send_octets = self.read_send_queue()
-                if self.send_octets:
-                    return
+        if not self.drain:
+            self._write_once()
+            return
 
-                self.send_pending = False
-                self.poller.unset_writable(self)
+        budget = self.drain_budget
+        while True:
+            count, offered = self._write_once()
+            if count <= 0 or count < offered or not self.send_pending:
+                return
+            budget -= count
+            if budget <= 0:
+                self.poller.call_soon(self._drain_write)
+                return
 
-                self.send_complete()
-                if self.close_pending:
-                    self.poller.close(self)
+    #
+    # When the socket supports sendmsg() (and net.stream.gather is not
+    # false) we send the current buffer along with the bytes-like pieces
+    # queued after it, up to IOV_MAX pieces and GATHER_MAX bytes, with a
+    # single syscall.  A file-like (or text) piece ends the gathering,
+    # since we read it lazily.  After a partial send we continue from
+    # the first piece that was not sent completely.
+    #
+    # When a queued file-like is a regular file (and net.stream.sendfile
+    # is not false) read_send_queue() returns a FileRange, and we send
+    # from the file to the socket using sendfile(), which avoids copying
+    # the file through Python.  We seek the file to the end of the range
+    # when we are done, as if we had read it.
+    #
+    # When net.stream.zerocopy_threshold is set, we send pieces at least
+    # that big using MSG_ZEROCOPY, so that the kernel does not copy them
+    # but pins their memory until the data is acknowledged.  Therefore we
+    # keep a reference to each piece until the kernel reports, through the
+    # error queue of the socket, that the sends using it completed, and
+    # then we call zerocopy_complete(), so the owner of a pooled buffer
+    # knows when it can reuse it.  We read the error queue when the
+    # poller dispatches an event (completions make the socket report an
+    # error condition) and periodically while sends are outstanding.
+    # If the kernel says that it copied the data anyway (e.g. on the
+    # loopback interface) we stop using zero-copy for this stream.
+    #
+
+    def _gather(self):
+        """ Return the pieces to send with sendmsg() and their size """
+        queue = self.send_queue
+        if (not queue or not isinstance(queue[0], GATHERABLE) or
+                self.send_octets.__class__ is FileRange):
+            return None, 0
+        vector = [self.send_octets]
+        total = len(self.send_octets)
+        for piece in queue:
+            if (len(vector) >= IOV_MAX or total >= GATHER_MAX or
+                    not isinstance(piece, GATHERABLE)):
+                break
+            vector.append(piece)
+            total += len(piece)
+        return vector, total
+
+    def _advance(self, count):
+        """ Skip count bytes sent using sendmsg() """
+        length = len(self.send_octets)
+        if count < length:
+            self.send_octets = six.buff(self.send_octets, count)
+            return
+        count -= length
+        while count > 0:
+            piece = self.send_queue.popleft()
+            if count < len(piece):
+                self.send_octets = six.buff(piece, count)
                 return
+            count -= len(piece)
+        self.send_octets = self.read_send_queue()
 
-            if count < len(self.send_octets):
+    def _write_once(self):
+        """ Send once and return the number of bytes sent and the
+            number of bytes we tried to send """
+        vector, piece = None, self.send_octets
+        zerocopy = (self.zerocopy_threshold and
+                    piece.__class__ is not FileRange and
+                    len(piece) >= self.zerocopy_threshold)
+        if self.gather and not zerocopy:
+            vector, offered = self._gather()
+        if vector:
+            status, count = self.sock.sosendmsg(vector)
+        elif zerocopy:
+            offered = len(piece)
+            status, count, pinned = self.sock.sosend_zerocopy(piece)
+            if pinned and status == SUCCESS and count > 0:
+                self._zerocopy_pin(piece)
+        elif piece.__class__ is FileRange:
+            offered = min(len(piece), SENDFILE_MAX)
+            status, count = self.sock.sosendfile(piece.fileno, piece.offset,
+                                                 offered)
+            if status == SUCCESS and count == 0:
+                raise RuntimeError("File truncated while sending it")
+        else:
+            offered = len(self.send_octets)
+            status, count = self.sock.sosend(self.send_octets)
+
+        if status == SUCCESS and count > 0:
+            self.bytes_sent_tot += count
+            self.poller.charge(count)
+            if self.poller.tracer is not None:
+                self.poller.tracer.record(WRITE, self.filenum, count, ticks())
+
+            if count > offered:
+                raise RuntimeError("Sent more than expected")
+
+            if vector:
+                self._advance(count)
+            elif piece.__class__ is FileRange:
+                piece.advance(count)
+                if not piece:
+                    self.send_octets = self.read_send_queue()
+            elif count == offered:
+                self.send_octets = self.read_send_queue()
+            else:
                 self.send_octets = six.buff(self.send_octets, count)
+
+            if piece.__class__ is not FileRange:
+                self._sent(count)
+
+            if count < offered:
                 self.poller.set_writable(self)
-                return
+                return count, offered
+
+            if self.send_octets:
+                return count, offered
+
+            self.send_pending = False
+            self.poller.unset_writable(self)
+            if self._zc_pinned and self._zc_timer is None:
+                self._zc_timer = self.poller.call_later(ZEROCOPY_REAP,
+                                                        self._zerocopy_timer)
 
-            raise RuntimeError("Sent more than expected")
+            self.send_complete()
+            if self.close_pending:
+                self.poller.close(self)
+            return count, offered
 
         if status == WANT_WRITE:
-            return
+            return 0, offered
 
         if status == CONNRST and count == 0:
             self.rst = True
             self.poller.close(self)
-            return
+            return 0, offered
 
         if status == SUCCESS and count == 0:
             self.eof = True
             self.poller.close(self)
-            return
+            return 0, offered
 
         if status == SUCCESS and count < 0:
             raise RuntimeError("Unexpected count value")
@@ -269,3 +772,70 @@ class Stream(Pollable):
 
     def send_complete(self):
         """ Called when send is complete """
+
+    def zerocopy_complete(self, buff):
+        """ Called when the kernel does not use buff anymore """
+
+    def _zerocopy_pin(self, piece):
+        """ Keep the buffer of piece until the send completes """
+        buff = getattr(piece, "obj", piece)  # Unwrap memoryviews
+        self._zc_pinned[self._zc_next] = buff
+        self._zc_next = (self._zc_next + 1) & 0xffffffff
+        self._zc_refs[id(buff)] = self._zc_refs.get(id(buff), 0) + 1
+
+    def _zerocopy_unref(self, buff):
+        """ Drop a reference to buff and maybe release it """
+        refs = self._zc_refs.pop(id(buff)) - 1
+        if refs > 0:
+            self._zc_refs[id(buff)] = refs
+            return
+        try:
+            self.zerocopy_complete(buff)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            logging.error("stream: zerocopy_complete() failed", exc_info=1)
+
+    def _zerocopy_reap(self):
+        """ Release the buffers of completed zero-copy sends """
+        for first, last, copied in self.sock.zerocopy_completions():
+            if copied and self.zerocopy_threshold:
+                logging.debug("stream: kernel copied data; no zero-copy")
+                self.zerocopy_threshold = 0
+            sendid = first
+            while True:
+                buff = self._zc_pinned.pop(sendid, None)
+                if buff is not None:
+                    self._zerocopy_unref(buff)
+                if sendid == last:
+                    break
+                sendid = (sendid + 1) & 0xffffffff
+
+    def _zerocopy_timer(self):
+        """ Periodically reap completions while sends are outstanding """
+        self._zc_timer = None
+        if self.close_complete:
+            return
+        self._zerocopy_reap()
+        if self._zc_pinned:
+            self._zc_timer = self.poller.call_later(ZEROCOPY_REAP,
+                                                    self._zerocopy_timer)
+
+    def _zerocopy_release(self):
+        """ Release all the pinned buffers at close """
+        if self._zc_timer is not None:
+            self._zc_timer.cancel()
+            self._zc_timer = None
+        pinned, self._zc_pinned = self._zc_pinned, {}
+        for buff in pinned.values():
+            self._zerocopy_unref(buff)
+
+def _release_view(view):
+    """ Release view and return True if its buffer can be reused """
+    if not hasattr(view, "release"):
+        return True  # Python 2
+    try:
+        view.release()
+    except BufferError:
+        return False  # Somebody still holds a buffer export
+    return True
@@ -38,7 +38,8 @@ class StreamHandler(object):
 
     def listen(self, endpoint):
         """ Listen to the specified endpoint """
-        sockets = utils_net.listen(endpoint)
+        sockets = utils_net.listen(endpoint,
+                                   self.conf.get("net.listen.reuseport", False))
         if not sockets:
             self.bind_failed(endpoint)
             return
@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Queue of cancellable timers used by the poller '''
+
+#
+# Timers live in a binary heap ordered by expiration time.  Cancelling
+# a timer only marks its handle (lazy deletion), and cancelled handles
+# are dropped when they reach the top of the heap.  When most of the
+# heap is made of cancelled handles we rebuild it, so that protocols
+# that arm and cancel a timer per request do not make it grow forever.
+#
+# Unlike sched.scheduler there is no lock, since the queue is only
+# used by the thread running the poller.
+#
+
+import heapq
+
+# Do not compact the heap unless it contains at least this many
+# cancelled handles, or we would rebuild small heaps too often
+COMPACT_MIN = 256
+
+class Handle(object):
+    ''' Handle of a deferred call '''
+
+    __slots__ = ('_func', '_args', '_cancelled')
+
+    def __init__(self, func, args):
+        self._func = func
+        self._args = args
+        self._cancelled = False
+
+    def __repr__(self):
+        return "handle %s%s" % (self._func,
+                                " (cancelled)" if self._cancelled else "")
+
+    def cancel(self):
+        ''' Cancel this call '''
+        self._cancelled = True
+        self._func = None
+        self._args = None
+
+    def cancelled(self):
+        ''' Return True if this call was cancelled '''
+        return self._cancelled
+
+    def run(self):
+        ''' Run the callback '''
+        self._func(*self._args)
+
+class TimerHandle(Handle):
+    ''' Handle of a scheduled timer '''
+
+    __slots__ = ('when', '_seqno', '_queue')
+
+    def __init__(self, when, seqno, func, args, queue):
+        Handle.__init__(self, func, args)
+        self.when = when
+        self._seqno = seqno
+        self._queue = queue
+
+    def __lt__(self, other):
+        return (self.when, self._seqno) < (other.when, other._seqno)
+
+    def __repr__(self):
+        return "timer %s at %f%s" % (self._func, self.when,
+                                     " (cancelled)" if self._cancelled else "")
+
+    def cancel(self):
+        ''' Cancel this timer '''
+        if self._cancelled:
+            return
+        Handle.cancel(self)
+        if self._queue is not None:
+            self._queue._handle_cancelled()
+            self._queue = None
+
+class TimerQueue(object):
+    ''' Heap of timers with lazy deletion '''
+
+    def __init__(self):
+        self._heap = []
+        self._seqno = 0
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def schedule(self, when, func, args):
+        ''' Schedule func(*args) at when and return its handle '''
+        self._seqno += 1
+        handle = TimerHandle(when, self._seqno, func, args, self)
+        heapq.heappush(self._heap, handle)
+        return handle
+
+    def _handle_cancelled(self):
+        ''' Called when one of our handles is cancelled '''
+        self._cancelled += 1
+        if (self._cancelled >= COMPACT_MIN and
+                self._cancelled * 2 > len(self._heap)):
+            self.compact()
+
+    def compact(self):
+        ''' Remove cancelled handles from the heap '''
+        self._heap = [handle for handle in self._heap
+                      if not handle._cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _drop_cancelled(self):
+        ''' Pop cancelled handles from the top of the heap '''
+        heap = self._heap
+        while heap and heap[0]._cancelled:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+
+    def timeout(self, now):
+        ''' Seconds until the next timer, or None if there are none '''
+        self._drop_cancelled()
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0].when - now)
+
+    def pop_expired(self, now):
+        ''' Pop and return the handles of the timers due at now '''
+        heap = self._heap
+        expired = []
+        while heap and heap[0].when <= now:
+            handle = heapq.heappop(heap)
+            if handle._cancelled:
+                self._cancelled -= 1
+                continue
+            handle._queue = None
+            expired.append(handle)
+        return expired
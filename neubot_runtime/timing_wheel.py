@@ -0,0 +1,129 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Hashed timing wheel indexing pollables by watchdog deadline '''
+
+#
+# The wheel is an array of slots, where each slot covers `resolution`
+# seconds and is a set of pollables.  A pollable whose deadline falls
+# in tick T lives in slot T % size.  Deadlines farther than a whole
+# revolution share the slot with nearer ones, so when a slot comes due
+# we re-file the pollables whose deadline is still in the future.
+#
+# Adding, removing and rearming a pollable are O(1), and expiring
+# only touches the slots that came due since the last call, hence the
+# cost is proportional to the number of expirations and not to the
+# number of pollables in the wheel.
+#
+# Pollables keep track of the wheel and slot they are filed into, so
+# that Pollable.set_timeout() can rearm itself in O(1).
+#
+
+import math
+
+# Default resolution of the wheel in seconds
+RESOLUTION = 1.0
+
+# Default number of slots
+SIZE = 512
+
+class TimingWheel(object):
+    ''' Hashed timing wheel of pollables '''
+
+    def __init__(self, now, resolution=RESOLUTION, size=SIZE):
+        self._resolution = resolution
+        self._size = size
+        self._slots = [set() for _ in range(size)]
+        self._tick = int(now / resolution)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _file(self, pollable):
+        ''' File pollable into the slot of its deadline '''
+        deadline = pollable.deadline()
+        if deadline is None:
+            pollable._wheel_slot = -1
+            return
+        tick = max(int(math.ceil(deadline / self._resolution)),
+                   self._tick + 1)
+        slot = tick % self._size
+        self._slots[slot].add(pollable)
+        pollable._wheel_slot = slot
+
+    def _unfile(self, pollable):
+        ''' Remove pollable from its slot '''
+        if pollable._wheel_slot >= 0:
+            self._slots[pollable._wheel_slot].discard(pollable)
+            pollable._wheel_slot = -1
+
+    def add(self, pollable):
+        ''' Start tracking the deadline of pollable '''
+        if pollable._wheel is self:
+            return
+        if pollable._wheel is not None:
+            pollable._wheel.remove(pollable)
+        pollable._wheel = self
+        self._count += 1
+        self._file(pollable)
+
+    def remove(self, pollable):
+        ''' Stop tracking the deadline of pollable '''
+        if pollable._wheel is not self:
+            return
+        self._unfile(pollable)
+        pollable._wheel = None
+        self._count -= 1
+
+    def rearm(self, pollable):
+        ''' Move pollable after its deadline changed '''
+        if pollable._wheel is not self:
+            return
+        self._unfile(pollable)
+        self._file(pollable)
+
+    def expire(self, now):
+        ''' Return the pollables whose deadline is not after now.  They
+            remain tracked by the wheel, but are not filed anymore until
+            rearm() is called for them. '''
+
+        target = int(now / self._resolution)
+        if target <= self._tick:
+            return []
+        first = max(self._tick + 1, target - self._size + 1)
+        self._tick = target
+
+        expired = []
+        for tick in range(first, target + 1):
+            slot = self._slots[tick % self._size]
+            if not slot:
+                continue
+            for pollable in list(slot):
+                slot.remove(pollable)
+                pollable._wheel_slot = -1
+                deadline = pollable.deadline()
+                if deadline is not None and deadline <= now:
+                    expired.append(pollable)
+                else:
+                    self._file(pollable)
+
+        return expired
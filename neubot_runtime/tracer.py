@@ -0,0 +1,149 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Ring buffer of poller events, exported as Chrome trace JSON '''
+
+#
+# When tracing is enabled (see `poller.trace`) the poller and the streams
+# record what happens on the loop: polls (with their duration and the
+# number of ready file descriptors), reads and writes (with the number
+# of bytes), timers and deferred callbacks (with their duration) and
+# closes.  Each record has a fixed size and lives in preallocated arrays
+# used as a ring buffer, so that recording does not allocate objects and
+# the memory is bounded: when the buffer is full, the oldest records are
+# overwritten.  Hence the tracer can run continuously, and when something
+# goes wrong we can save the last few seconds:
+#
+#     POLLER.tracer.dump("/tmp/trace.json", seconds=5)
+#
+# and load the file with chrome://tracing or https://ui.perfetto.dev.
+# The loop activity (polls, timers) is shown in the "loop" track, and
+# the activity of each file descriptor in its own track.
+#
+
+import array
+import json
+
+# Default number of records we keep
+CAPACITY = 1 << 16
+
+# Kinds of record
+(POLL, READ, WRITE, TIMER, CALLBACK, CLOSE) = range(6)
+
+KIND_NAMES = ("poll", "read", "write", "timer", "callback", "close")
+
+class Tracer(object):
+    ''' Ring buffer of fixed-size event records '''
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._when = array.array("d", [0.0]) * capacity
+        self._duration = array.array("d", [0.0]) * capacity
+        self._kind = array.array("b", [0]) * capacity
+        self._fileno = array.array("i", [0]) * capacity
+        self._value = array.array("l", [0]) * capacity
+        self._next = 0
+        self._count = 0
+        self._names = []
+        self._name_ids = {}
+
+    def __len__(self):
+        return self._count
+
+    def intern(self, name):
+        ''' Return a number identifying name, for use as a value '''
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+    def record(self, kind, fileno, value, when, duration=0.0):
+        ''' Record an event of kind on fileno that happened at the
+            ticks() time when and lasted duration seconds '''
+        index = self._next
+        self._when[index] = when
+        self._duration[index] = duration
+        self._kind[index] = kind
+        self._fileno[index] = fileno
+        self._value[index] = value
+        self._next = (index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        ''' Forget all the records '''
+        self._next = 0
+        self._count = 0
+
+    def records(self, seconds=None):
+        ''' Return the (kind, fileno, value, when, duration) records,
+            oldest first, optionally only of the last seconds '''
+        first = (self._next - self._count) % self.capacity
+        result = []
+        for offset in range(self._count):
+            index = (first + offset) % self.capacity
+            result.append((self._kind[index], self._fileno[index],
+                           self._value[index], self._when[index],
+                           self._duration[index]))
+        if seconds is not None and result:
+            horizon = result[-1][3] - seconds
+            result = [record for record in result if record[3] >= horizon]
+        return result
+
+    def to_chrome(self, seconds=None):
+        ''' Return the records in the Chrome trace event format '''
+        events = []
+        tracks = set()
+        for kind, fileno, value, when, duration in self.records(seconds):
+            event = {
+                "name": KIND_NAMES[kind],
+                "pid": 0,
+                "tid": fileno if fileno >= 0 else 0,
+                "ts": when * 1000000,
+            }
+            if kind in (TIMER, CALLBACK):
+                event["name"] = self._names[value]
+            elif kind == POLL:
+                event["args"] = {"ready": value}
+            elif kind in (READ, WRITE):
+                event["args"] = {"bytes": value}
+            if duration > 0.0 or kind in (POLL, TIMER, CALLBACK):
+                event["ph"] = "X"
+                event["dur"] = duration * 1000000
+            else:
+                event["ph"] = "i"
+                event["s"] = "t"
+            tracks.add(event["tid"])
+            events.append(event)
+        for tid in sorted(tracks):
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": 0, "tid": tid,
+                "args": {"name": "fd %d" % tid if tid else "loop"},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path, seconds=None):
+        ''' Save the records, optionally only of the last seconds, as
+            Chrome trace JSON into the file at path '''
+        trace = self.to_chrome(seconds)
+        with open(path, "w") as filep:
+            json.dump(trace, filep)
@@ -91,7 +91,12 @@ def addrinfo_key(ainfo):
     ''' Map addrinfo to protocol family '''
     return COMPARE_AF[ainfo[0]]
 
-def listen(epnt):
+#
+# With reuseport, multiple processes (or threads) can listen to the
+# same endpoint with their own socket, and the kernel load balances
+# incoming connections among them (Linux >= 3.9, BSD).
+#
+def listen(epnt, reuseport=False):
     ''' Listen to all sockets represented by epnt '''
 
     logging.debug('listen(): about to listen to: %s', str(epnt))
@@ -105,7 +110,7 @@ def listen(epnt):
     # Allow to listen on a list of addresses
     if epnt[0] and ' ' in epnt[0]:
         for address in epnt[0].split():
-            result = listen((address.strip(), epnt[1]))
+            result = listen((address.strip(), epnt[1]), reuseport)
             sockets.extend(result)
         return sockets
 
@@ -132,6 +137,10 @@ def listen(epnt):
 
             sock = socket.socket(ainfo[0], socket.SOCK_STREAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuseport:
+                if not hasattr(socket, 'SO_REUSEPORT'):
+                    raise RuntimeError('listen(): SO_REUSEPORT not available')
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             if ainfo[0] == socket.AF_INET6:
                 try:
                     sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
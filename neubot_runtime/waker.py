@@ -0,0 +1,107 @@
+#
+# Copyright (c) 2015
+#     Nexa Center for Internet & Society, Politecnico di Torino (DAUIN)
+#     and Simone Basso <bassosimone@gmail.com>.
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Pollable used to wake up the poller from other threads '''
+
+#
+# On Linux we use an eventfd, elsewhere we fall back to a connected
+# pair of sockets (the self-pipe trick, using sockets because select()
+# on Windows does not work with pipes).  Other threads call wakeup()
+# and the poller, which always monitors the waker for readability,
+# returns from the backend and runs the callbacks they queued.
+#
+# We write at most once until the poller drains the waker, so that a
+# burst of wakeups from worker threads costs a single syscall.
+#
+
+import errno
+import os
+import socket
+
+from .pollable import Pollable
+from .pollable import PRIORITY_HIGH
+
+class Waker(Pollable):
+    ''' Wake up the poller from another thread '''
+
+    def __init__(self):
+        Pollable.__init__(self)
+        self.set_timeout(-1)
+        self.set_priority(PRIORITY_HIGH)
+        self.edge_safe = True
+        self._signaled = False
+        self._eventfd = -1
+        self._reader = None
+        self._writer = None
+        if hasattr(os, "eventfd"):
+            self._eventfd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self._reader, self._writer = socket.socketpair()
+            self._reader.setblocking(False)
+            self._writer.setblocking(False)
+
+    def __repr__(self):
+        return "waker"
+
+    def fileno(self):
+        if self._eventfd >= 0:
+            return self._eventfd
+        return self._reader.fileno()
+
+    def wakeup(self):
+        ''' Wake up the poller (safe to call from any thread) '''
+        if self._signaled:
+            return
+        self._signaled = True
+        try:
+            if self._eventfd >= 0:
+                os.eventfd_write(self._eventfd, 1)
+            else:
+                self._writer.send(b"\0")
+        except (IOError, OSError) as error:
+            # If the buffer is full a wakeup is pending anyway
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def handle_read(self):
+        try:
+            if self._eventfd >= 0:
+                os.eventfd_read(self._eventfd)
+            else:
+                while self._reader.recv(4096):
+                    pass
+        except (IOError, OSError) as error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        # Clear the flag only after draining: had we cleared it before,
+        # the write of a wakeup() racing with us could be drained along
+        # with the old ones, and the flag would remain set forever.  A
+        # wakeup() that sees the flag still set is not lost, because the
+        # poller runs the callbacks queued so far after this method.
+        self._signaled = False
+
+    def handle_close(self):
+        if self._eventfd >= 0:
+            os.close(self._eventfd)
+            self._eventfd = -1
+        else:
+            self._reader.close()
+            self._writer.close()